@@ -1,33 +1,256 @@
 """
 Authentication utilities for JWT token handling and password hashing.
 """
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Callable, Dict, Optional, Set, Tuple
 from jose import JWTError, jwt
 import bcrypt
+from bson import ObjectId
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from config import settings
 from models import TokenData, UserRole
 
+logger = logging.getLogger(__name__)
+
 # HTTP Bearer token
 security = HTTPBearer()
 
 
+class VerifiedTokenCache:
+    """
+    LRU of tokens that already passed signature verification.
+    
+    Entries are keyed by the token's SHA-256 digest and kept until the
+    token's own `exp`, so repeat requests skip jwt.decode. Tokens are
+    stateless, so caching changes nothing about their validity: a role
+    change or account deletion only takes effect once the user's current
+    token expires (`access_token_expire_minutes`), cached or not.
+    """
+    
+    def __init__(self):
+        # digest -> (token data, exp as a Unix timestamp)
+        self._entries: "OrderedDict[str, Tuple[TokenData, float]]" = OrderedDict()
+        self._by_user: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.user_evictions = 0
+    
+    @staticmethod
+    def digest(token: str) -> str:
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()
+    
+    def get(self, digest: str) -> Optional[TokenData]:
+        entry = self._entries.get(digest)
+        if entry is None:
+            self.misses += 1
+            return None
+        token_data, expires_at = entry
+        if expires_at <= time.time():
+            self._drop(digest)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(digest)
+        self.hits += 1
+        return token_data
+    
+    def put(self, digest: str, token_data: TokenData, expires_at: float) -> None:
+        if settings.token_cache_size <= 0:
+            return
+        self._drop(digest)
+        self._entries[digest] = (token_data, expires_at)
+        self._by_user.setdefault(token_data.user_id, set()).add(digest)
+        while len(self._entries) > settings.token_cache_size:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+    
+    def evict_user(self, user_id: str) -> None:
+        """
+        Free the cached entries of a user, e.g. one who was deleted.
+        
+        This does not revoke anything: a still-valid token is simply
+        verified and cached again on its next request.
+        """
+        digests = self._by_user.pop(user_id, set())
+        for digest in digests:
+            self._entries.pop(digest, None)
+        self.user_evictions += len(digests)
+    
+    def _drop(self, digest: str) -> None:
+        entry = self._entries.pop(digest, None)
+        if entry is None:
+            return
+        user_digests = self._by_user.get(entry[0].user_id)
+        if user_digests is not None:
+            user_digests.discard(digest)
+            if not user_digests:
+                del self._by_user[entry[0].user_id]
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "capacity": settings.token_cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "user_evictions": self.user_evictions
+        }
+
+
+token_cache = VerifiedTokenCache()
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a password against its hash."""
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 
-def get_password_hash(password: str) -> str:
-    """Hash a password."""
+def hash_rounds(hashed_password: str) -> Optional[int]:
+    """The bcrypt cost a hash was made with ("$2b$12$..." -> 12)."""
+    try:
+        return int(hashed_password.split("$")[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def _time_hash(rounds: int) -> float:
+    """Seconds one bcrypt hash takes at this cost."""
+    started = time.perf_counter()
+    bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds=rounds))
+    return time.perf_counter() - started
+
+
+def get_password_hash(password: str, rounds: Optional[int] = None) -> str:
+    """Hash a password at the given bcrypt cost (the configured one by default)."""
     # Bcrypt has a 72 byte limit
     password_bytes = password.encode('utf-8')[:72]
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=rounds or password_hasher.rounds)
     hashed = bcrypt.hashpw(password_bytes, salt)
     return hashed.decode('utf-8')
 
 
+class PasswordHasher:
+    """
+    Runs bcrypt on a small dedicated thread pool.
+    
+    bcrypt releases the GIL but takes hundreds of milliseconds per call,
+    so calling it from a handler stalls the event loop. The pool caps how
+    many hashes run at once, and a semaphore caps how many may wait, so a
+    burst of logins queues (or is turned away with 503) instead of eating
+    every thread the worker has.
+    
+    `rounds` is the bcrypt cost of new hashes. It comes from
+    `bcrypt_rounds`, or from `calibrate()` when `bcrypt_target_ms` is set.
+    Workers calibrating on different hardware can settle on different
+    costs and keep rehashing each other's users, so pin `bcrypt_rounds`
+    when that matters.
+    """
+    
+    def __init__(self):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._rehash_tasks: Set[asyncio.Task] = set()
+        self.rounds = settings.bcrypt_rounds
+    
+    def start(self) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.password_hash_workers,
+            thread_name_prefix="bcrypt"
+        )
+        logger.info(f"Password hasher started with {settings.password_hash_workers} threads")
+    
+    def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+    
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(settings.password_hash_max_pending)
+        try:
+            await asyncio.wait_for(
+                self._slots.acquire(),
+                timeout=settings.password_hash_queue_timeout_seconds
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many sign-in requests, please retry shortly",
+                headers={"Retry-After": "1"}
+            )
+        
+        try:
+            if self._executor is None:
+                # Not started (scripts, one-off tools): still keep the loop free
+                return await asyncio.to_thread(func, *args)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._slots.release()
+    
+    async def hash(self, password: str) -> str:
+        """Async get_password_hash."""
+        return await self._run(get_password_hash, password)
+    
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """Async verify_password."""
+        return await self._run(verify_password, plain_password, hashed_password)
+    
+    async def calibrate(self) -> None:
+        """Pick the cost whose hash time is closest to `bcrypt_target_ms` without exceeding it."""
+        base_rounds = settings.bcrypt_min_rounds
+        samples = [await self._run(_time_hash, base_rounds) for _ in range(3)]
+        base_ms = min(samples) * 1000
+        
+        # Each extra round doubles the work
+        rounds = base_rounds
+        while rounds < settings.bcrypt_max_rounds and base_ms * 2 ** (rounds + 1 - base_rounds) <= settings.bcrypt_target_ms:
+            rounds += 1
+        self.rounds = rounds
+        logger.info(
+            f"bcrypt cost calibrated to {rounds} "
+            f"(~{base_ms * 2 ** (rounds - base_rounds):.0f}ms for a {settings.bcrypt_target_ms}ms target)"
+        )
+    
+    def needs_rehash(self, hashed_password: str) -> bool:
+        return hash_rounds(hashed_password) != self.rounds
+    
+    def rehash_in_background(self, db, user_id: str, plain_password: str, old_hash: str) -> None:
+        """
+        Re-store a just-verified password at the current cost without delaying the login.
+        
+        The plaintext only lives in this task's memory; it is never queued
+        or persisted. The update is skipped if the hash changed meanwhile.
+        """
+        async def rehash() -> None:
+            try:
+                new_hash = await self.hash(plain_password)
+                await db.users.update_one(
+                    {"_id": ObjectId(user_id), "password": old_hash},
+                    {"$set": {"password": new_hash, "updated_at": datetime.utcnow()}}
+                )
+                logger.info(f"Rehashed password of user {user_id} at cost {self.rounds}")
+            except Exception as e:
+                logger.error(f"Failed to rehash password of user {user_id}: {e}")
+        
+        task = asyncio.create_task(rehash())
+        # Hold a reference so the task isn't garbage collected mid-flight
+        self._rehash_tasks.add(task)
+        task.add_done_callback(self._rehash_tasks.discard)
+
+
+password_hasher = PasswordHasher()
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token."""
     to_encode = data.copy()
@@ -44,7 +267,12 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 
 
 def decode_access_token(token: str) -> TokenData:
-    """Decode and verify a JWT access token."""
+    """Decode and verify a JWT access token, reusing earlier verifications."""
+    digest = token_cache.digest(token)
+    token_data = token_cache.get(digest)
+    if token_data is not None:
+        return token_data
+    
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -61,6 +289,8 @@ def decode_access_token(token: str) -> TokenData:
             raise credentials_exception
         
         token_data = TokenData(user_id=user_id, email=email, role=role)
+        if payload.get("exp") is not None:
+            token_cache.put(digest, token_data, float(payload["exp"]))
         return token_data
         
     except JWTError:
@@ -0,0 +1,255 @@
+"""
+In-memory index of booked time intervals per parking slot.
+
+Each slot keeps its live bookings sorted by start time together with a
+running maximum of end times, so "is this slot free between T1 and T2"
+is a single binary search. A slot can therefore be sold many times a
+day as long as its bookings do not overlap. Schedules are loaded lazily
+from the bookings collection, a whole lot at a time for searches or a
+single slot when booking, and reloaded after
+`booking_index_refresh_seconds` so edits made by other workers are
+picked up. Concurrent loads of the same lot or slot share one query,
+while loads of different lots and slots run in parallel.
+"""
+import asyncio
+import logging
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from config import settings
+from models import BookingStatus
+from utils import to_naive_utc
+
+logger = logging.getLogger(__name__)
+
+# Bookings in these states hold their slot for the booked window
+LIVE_BOOKING_STATUSES = [
+    BookingStatus.PENDING,
+    BookingStatus.CONFIRMED,
+    BookingStatus.ACTIVE,
+]
+
+
+class SlotSchedule:
+    """Booked intervals of one slot, sorted by start time."""
+
+    def __init__(self):
+        self.starts: List[datetime] = []
+        self.ends: List[datetime] = []
+        self.booking_ids: List[str] = []
+        # max_ends[i] is the latest end among intervals 0..i
+        self.max_ends: List[datetime] = []
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def add(self, booking_id: str, start: datetime, end: datetime) -> None:
+        position = bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
+        self.booking_ids.insert(position, booking_id)
+        self.max_ends.insert(position, end)
+        self._refresh_max_ends(position)
+
+    def remove(self, booking_id: str, start: datetime) -> bool:
+        position = bisect_left(self.starts, start)
+        while position < len(self.starts) and self.starts[position] == start:
+            if self.booking_ids[position] == booking_id:
+                break
+            position += 1
+        else:
+            return False
+        del self.starts[position]
+        del self.ends[position]
+        del self.booking_ids[position]
+        del self.max_ends[position]
+        self._refresh_max_ends(position)
+        return True
+
+    def overlaps(self, start: datetime, end: datetime) -> bool:
+        """Return True if any booked interval intersects [start, end)."""
+        # Intervals starting before `end` are the only candidates; among
+        # them, one overlaps exactly when the latest end is after `start`.
+        candidates = bisect_left(self.starts, end)
+        return candidates > 0 and self.max_ends[candidates - 1] > start
+
+    def _refresh_max_ends(self, position: int) -> None:
+        running = self.max_ends[position - 1] if position > 0 else None
+        for index in range(position, len(self.ends)):
+            end = self.ends[index]
+            running = end if running is None or end > running else running
+            self.max_ends[index] = running
+
+
+class BookingIntervalIndex:
+    """Per-slot booking schedules, loaded lazily one lot at a time."""
+
+    def __init__(self):
+        self._schedules: Dict[str, SlotSchedule] = {}
+        # booking id -> (slot id, start) so removals can bisect
+        self._bookings: Dict[str, Tuple[str, datetime]] = {}
+        self._lot_slots: Dict[str, Set[str]] = {}
+        self._lot_loaded_at: Dict[str, float] = {}
+        self._slot_loaded_at: Dict[str, float] = {}
+        # ("lot" | "slot", id) -> future resolved when its load finishes
+        self._loading: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    @staticmethod
+    def _within_refresh(loaded_at: Optional[float]) -> bool:
+        if loaded_at is None:
+            return False
+        max_age = settings.booking_index_refresh_seconds
+        return not max_age or time.monotonic() - loaded_at < max_age
+
+    def _is_fresh(self, lot_id: str) -> bool:
+        return self._within_refresh(self._lot_loaded_at.get(lot_id))
+
+    def _is_slot_fresh(self, lot_id: str, slot_id: str) -> bool:
+        return (
+            self._is_fresh(lot_id)
+            or self._within_refresh(self._slot_loaded_at.get(slot_id))
+        )
+
+    def _drop_slot(self, slot_id: str) -> None:
+        schedule = self._schedules.pop(slot_id, None)
+        for booking_id in schedule.booking_ids if schedule else []:
+            self._bookings.pop(booking_id, None)
+
+    async def _load(self, keys: List[Tuple[str, str]], load: Callable[[], Awaitable[None]]) -> None:
+        """Run `load` with `keys` marked in flight so other callers wait on it."""
+        future = asyncio.get_running_loop().create_future()
+        for key in keys:
+            self._loading[key] = future
+        try:
+            await load()
+        finally:
+            for key in keys:
+                if self._loading.get(key) is future:
+                    del self._loading[key]
+            # Waiters re-check freshness, so a failed load is retried by them
+            future.set_result(None)
+
+    async def ensure_lots_loaded(self, db, lot_ids: Iterable[str]) -> None:
+        """Load live bookings for every lot not yet (freshly) indexed."""
+        lot_ids = set(lot_ids)
+        while True:
+            stale = [lot_id for lot_id in lot_ids if not self._is_fresh(lot_id)]
+            if not stale:
+                return
+
+            in_flight = {
+                self._loading[("lot", lot_id)]
+                for lot_id in stale
+                if ("lot", lot_id) in self._loading
+            }
+            own = [lot_id for lot_id in stale if ("lot", lot_id) not in self._loading]
+            if own:
+                await self._load(
+                    [("lot", lot_id) for lot_id in own],
+                    lambda: self._load_lots(db, own)
+                )
+            if in_flight:
+                # asyncio.wait, unlike gather, never cancels the shared futures
+                await asyncio.wait(in_flight)
+
+    async def _load_lots(self, db, lot_ids: List[str]) -> None:
+        bookings = await self._fetch_live_bookings(db, {"lot_id": {"$in": lot_ids}})
+
+        for lot_id in lot_ids:
+            for slot_id in self._lot_slots.pop(lot_id, set()):
+                self._drop_slot(slot_id)
+        self._add_all(bookings)
+
+        loaded_at = time.monotonic()
+        for lot_id in lot_ids:
+            self._lot_loaded_at[lot_id] = loaded_at
+        logger.debug(f"Booking index loaded {len(bookings)} bookings for {len(lot_ids)} lots")
+
+    async def ensure_slot_loaded(self, db, lot_id: str, slot_id: str, force: bool = False) -> None:
+        """Load live bookings for one slot unless its schedule is fresh (or `force`)."""
+        key = ("slot", slot_id)
+        if force:
+            # A load already in flight may predate the change being looked for
+            await self._load([key], lambda: self._load_slot(db, slot_id))
+            return
+        while not self._is_slot_fresh(lot_id, slot_id):
+            in_flight = self._loading.get(key)
+            if in_flight is None:
+                await self._load([key], lambda: self._load_slot(db, slot_id))
+            else:
+                await asyncio.wait([in_flight])
+
+    async def _load_slot(self, db, slot_id: str) -> None:
+        bookings = await self._fetch_live_bookings(db, {"slot_id": slot_id})
+        self._drop_slot(slot_id)
+        self._add_all(bookings)
+        self._slot_loaded_at[slot_id] = time.monotonic()
+
+    @staticmethod
+    async def _fetch_live_bookings(db, query: dict) -> List[dict]:
+        cursor = db.bookings.find(
+            {
+                **query,
+                "status": {"$in": LIVE_BOOKING_STATUSES},
+                "end_time": {"$gt": datetime.utcnow()}
+            },
+            {"lot_id": 1, "slot_id": 1, "start_time": 1, "end_time": 1}
+        )
+        return await cursor.to_list(length=None)
+
+    def _add_all(self, bookings: List[dict]) -> None:
+        for booking in bookings:
+            self.add(
+                booking["lot_id"],
+                booking["slot_id"],
+                str(booking["_id"]),
+                booking["start_time"],
+                booking["end_time"]
+            )
+
+    def add(
+        self,
+        lot_id: str,
+        slot_id: str,
+        booking_id: str,
+        start: datetime,
+        end: datetime
+    ) -> None:
+        """Record a live booking, replacing any earlier copy of it."""
+        self.remove(booking_id)
+        start = to_naive_utc(start)
+        self._schedules.setdefault(slot_id, SlotSchedule()).add(
+            booking_id, start, to_naive_utc(end)
+        )
+        self._bookings[booking_id] = (slot_id, start)
+        self._lot_slots.setdefault(lot_id, set()).add(slot_id)
+
+    def remove(self, booking_id: str) -> None:
+        """Forget a booking that was cancelled, completed or moved."""
+        entry = self._bookings.pop(booking_id, None)
+        if entry is None:
+            return
+        slot_id, start = entry
+        schedule = self._schedules.get(slot_id)
+        if schedule is not None:
+            schedule.remove(booking_id, start)
+
+    def is_free(self, slot_id: str, start: datetime, end: datetime) -> bool:
+        schedule = self._schedules.get(slot_id)
+        if not schedule:
+            return True
+        return not schedule.overlaps(to_naive_utc(start), to_naive_utc(end))
+
+    def free_slots(
+        self,
+        slot_ids: Iterable[str],
+        start: datetime,
+        end: datetime
+    ) -> List[str]:
+        """Filter `slot_ids` down to those with no booking in the window."""
+        return [slot_id for slot_id in slot_ids if self.is_free(slot_id, start, end)]
+
+
+booking_index = BookingIntervalIndex()
@@ -0,0 +1,58 @@
+"""
+Check that every hot query is served by an index.
+Runs explain() on each query in indexes.HOT_QUERIES and reports the ones
+whose winning plan is a collection scan. Exits non-zero if any are found.
+
+Usage: python check_indexes.py [--create]
+  --create  create the registered indexes before checking
+"""
+import argparse
+import asyncio
+import logging
+import sys
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from config import settings
+from indexes import HOT_QUERIES, ensure_indexes, explain_query
+
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+logger = logging.getLogger(__name__)
+
+
+async def check_indexes(create: bool) -> int:
+    """Explain every hot query; return the number of unexpected collection scans."""
+    client = AsyncIOMotorClient(settings.mongodb_url)
+    db = client[settings.database_name]
+
+    if create:
+        await ensure_indexes(db)
+        logger.info("Registered indexes created\n")
+
+    collscans = 0
+    for query in HOT_QUERIES:
+        plan = await explain_query(db, query)
+
+        if plan["collscan"] and not query.allow_collscan:
+            collscans += 1
+            verdict = "COLLSCAN"
+        elif plan["collscan"]:
+            verdict = "collscan (allowed)"
+        else:
+            verdict = "ok"
+
+        details = ", ".join(plan["indexes"]) or "-"
+        if plan["in_memory_sort"]:
+            details += " + in-memory sort"
+        logger.info(f"{verdict:<20} {query.collection}: {query.name} [{details}]")
+
+    logger.info(f"\n{len(HOT_QUERIES)} queries checked, {collscans} collection scans")
+    client.close()
+    return collscans
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--create", action="store_true", help="create the registered indexes first")
+    args = parser.parse_args()
+    sys.exit(1 if asyncio.run(check_indexes(args.create)) else 0)
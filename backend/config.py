@@ -16,6 +16,14 @@ class Settings(BaseSettings):
     secret_key: str = "your-secret-key-change-in-production"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    token_cache_size: int = 10000  # verified tokens kept in memory; 0 disables
+    password_hash_workers: int = 2  # threads running bcrypt
+    password_hash_max_pending: int = 64  # bcrypt calls running or waiting
+    password_hash_queue_timeout_seconds: float = 5.0  # wait for a slot before answering 503
+    bcrypt_rounds: int = 12  # cost of new hashes; logins rehash passwords stored at another cost
+    bcrypt_target_ms: int = 0  # when set, pick the cost at startup so one hash takes about this long
+    bcrypt_min_rounds: int = 10
+    bcrypt_max_rounds: int = 16
     
     # Email
     smtp_host: str = "smtp.gmail.com"
@@ -33,6 +41,47 @@ class Settings(BaseSettings):
     frontend_url: str = "http://localhost:5173"
     backend_url: str = "http://localhost:8000"
     
+    # Search
+    lot_index_enabled: bool = True
+    lot_index_refresh_seconds: int = 300  # full reload to pick up other workers' edits
+    booking_index_refresh_seconds: int = 60
+    
+    # Background jobs
+    job_workers: int = 4
+    job_max_attempts: int = 5
+    job_retry_base_seconds: float = 2.0
+    job_lease_seconds: int = 300  # running jobs older than this are requeued on startup
+    
+    # Rendering (QR codes, PDF receipts)
+    render_workers: int = 2
+    qr_cache_size: int = 1024  # rendered QR images kept in memory
+    receipt_cache_dir: str = "./cache/receipts"
+    receipt_cache_max_bytes: int = 104857600  # 100MB
+    
+    # Booking lifecycle
+    lifecycle_enabled: bool = True
+    lifecycle_horizon_seconds: int = 900  # deadlines this far ahead are kept in memory
+    lifecycle_batch_size: int = 500
+    pending_expiry_minutes: int = 0  # 0 disables; nothing marks bookings paid yet
+    reconcile_interval_seconds: int = 600  # 0 disables the periodic slot counter check
+    reconcile_grace_seconds: int = 30  # lots changed more recently are left for the next run
+    
+    # Surge pricing
+    surge_enabled: bool = True
+    surge_refresh_seconds: int = 60
+    surge_occupancy_threshold: float = 0.7  # occupancy where surge starts
+    surge_max_multiplier: float = 2.0
+    surge_velocity_window_minutes: int = 30
+    surge_velocity_weight: float = 0.25  # per booking per slot per hour
+    
+    # Tariffs
+    tariff_utc_offset_minutes: int = 330  # tariff band times are local wall-clock times (IST)
+    
+    # Idempotency keys
+    idempotency_ttl_seconds: int = 86400
+    idempotency_lock_seconds: int = 60  # an unfinished attempt older than this can be retried
+    idempotency_cache_size: int = 1024
+    
     # File Upload
     max_upload_size: int = 5242880  # 5MB
     upload_dir: str = "./uploads"
@@ -2,8 +2,9 @@
 MongoDB database connection and initialization.
 """
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo import ASCENDING, DESCENDING, GEO2D
 from config import settings
+from indexes import ensure_indexes
+from migrations import run_migrations
 import logging
 
 logger = logging.getLogger(__name__)
@@ -30,6 +31,7 @@ async def connect_to_mongo():
         
         # Create indexes
         await create_indexes()
+        await run_migrations(db_instance.db)
         
     except Exception as e:
         logger.error(f"Failed to connect to MongoDB: {e}")
@@ -49,38 +51,7 @@ async def close_mongo_connection():
 async def create_indexes():
     """Create database indexes for better query performance."""
     try:
-        db = db_instance.db
-        
-        # Users collection indexes
-        await db.users.create_index("email", unique=True)
-        await db.users.create_index("role")
-        
-        # Parking lots collection indexes
-        await db.parking_lots.create_index([("location", GEO2D)])
-        await db.parking_lots.create_index("is_active")
-        await db.parking_lots.create_index("name")
-        
-        # Bookings collection indexes
-        await db.bookings.create_index("user_id")
-        await db.bookings.create_index("lot_id")
-        await db.bookings.create_index("status")
-        await db.bookings.create_index([("start_time", DESCENDING)])
-        await db.bookings.create_index([("end_time", DESCENDING)])
-        
-        # Reviews collection indexes
-        await db.reviews.create_index("lot_id")
-        await db.reviews.create_index("user_id")
-        await db.reviews.create_index([("created_at", DESCENDING)])
-        
-        # Vehicles collection indexes
-        await db.vehicles.create_index("user_id")
-        await db.vehicles.create_index("license_plate", unique=True)
-        
-        # Payments collection indexes
-        await db.payments.create_index("booking_id")
-        await db.payments.create_index("user_id")
-        await db.payments.create_index("status")
-        
+        await ensure_indexes(db_instance.db)
         logger.info("Database indexes created successfully")
         
     except Exception as e:
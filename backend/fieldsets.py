@@ -0,0 +1,69 @@
+"""
+Sparse fieldsets for list endpoints.
+
+A `fields=a,b,c` query parameter picks which response fields a client
+wants. Endpoints turn the selection into a MongoDB projection so unused
+document fields never leave the database, and serialize rows through a
+trimmed copy of the response model so only the chosen keys are encoded.
+"""
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Optional, Type
+
+from fastapi import HTTPException, status
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, create_model
+
+ALWAYS_INCLUDED = frozenset({"id"})
+
+
+def parse_fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[FrozenSet[str]]:
+    """Validate a comma-separated field list against a response model."""
+    if not fields:
+        return None
+    requested = {name.strip() for name in fields.split(",") if name.strip()}
+    unknown = requested - set(model.model_fields)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+        )
+    return frozenset(requested | ALWAYS_INCLUDED)
+
+
+def projection(selected: Iterable[str], sources: Dict[str, List[str]]) -> dict:
+    """
+    Build a MongoDB projection for the selected response fields.
+
+    `sources` maps response fields to the document fields they are built
+    from; fields not listed are read from the field of the same name.
+    """
+    document_fields = {"_id"}
+    for name in selected:
+        document_fields.update(sources.get(name, [name]))
+    return {name: 1 for name in document_fields}
+
+
+@lru_cache(maxsize=256)
+def trimmed_model(model: Type[BaseModel], selected: FrozenSet[str]) -> Type[BaseModel]:
+    """A copy of `model` keeping only the selected fields (cached per selection)."""
+    return create_model(
+        f"{model.__name__}Sparse",
+        **{
+            name: (field.annotation, field)
+            for name, field in model.model_fields.items()
+            if name in selected
+        }
+    )
+
+
+def sparse_response(
+    model: Type[BaseModel],
+    selected: FrozenSet[str],
+    rows: List[dict]
+) -> JSONResponse:
+    """Validate rows against the trimmed model and encode them."""
+    sparse = trimmed_model(model, selected)
+    return JSONResponse([
+        sparse(**row).model_dump(mode="json")
+        for row in rows
+    ])
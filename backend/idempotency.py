@@ -0,0 +1,197 @@
+"""
+Idempotency keys for endpoints that clients retry.
+
+A request carrying an `Idempotency-Key` header is recorded in the
+`idempotency_keys` collection before it runs, and its response is stored
+once it succeeds. Repeating the request with the same key returns the
+stored response without running the endpoint again; repeating it while
+the first attempt is still running gets a 409. Records expire through a
+TTL index after `idempotency_ttl_seconds`. Completed records are also
+kept in a small in-memory LRU so hot retries skip the database.
+
+Keys are scoped to the user and endpoint, and bound to a hash of the
+request body, so reusing a key for a different request is rejected.
+Failed requests are not recorded, so they can be retried as-is.
+"""
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo.errors import DuplicateKeyError
+
+from config import settings
+from database import get_database
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyStatus:
+    PROCESSING = "processing"
+    COMPLETED = "completed"
+
+
+class _ResponseCache:
+    """LRU of completed responses, keyed like the collection."""
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+
+    def get(self, record_id: str) -> Optional[dict]:
+        record = self._entries.get(record_id)
+        if record is None:
+            return None
+        if record["expires_at"] <= datetime.utcnow():
+            del self._entries[record_id]
+            return None
+        self._entries.move_to_end(record_id)
+        return record
+
+    def put(self, record: dict) -> None:
+        self._entries[record["_id"]] = record
+        self._entries.move_to_end(record["_id"])
+        while len(self._entries) > settings.idempotency_cache_size:
+            self._entries.popitem(last=False)
+
+
+_response_cache = _ResponseCache()
+
+
+def _fingerprint(request_body: Any) -> str:
+    encoded = json.dumps(jsonable_encoder(request_body), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def _replay(record: dict, fingerprint: str) -> JSONResponse:
+    if record["fingerprint"] != fingerprint:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"{IDEMPOTENCY_HEADER} was already used for a different request"
+        )
+    return JSONResponse(
+        content=record["response_body"],
+        status_code=record["status_code"],
+        headers={REPLAYED_HEADER: "true"}
+    )
+
+
+async def _acquire(db, record_id: str, fingerprint: str) -> Tuple[bool, Optional[dict]]:
+    """
+    Record a new attempt for this key.
+
+    Returns (True, None) when the caller should run the request, or
+    (False, record) when a completed record exists.
+    """
+    now = datetime.utcnow()
+    try:
+        await db.idempotency_keys.insert_one({
+            "_id": record_id,
+            "fingerprint": fingerprint,
+            "status": IdempotencyStatus.PROCESSING,
+            "locked_at": now,
+            "expires_at": now + timedelta(seconds=settings.idempotency_ttl_seconds)
+        })
+        return True, None
+    except DuplicateKeyError:
+        pass
+
+    record = await db.idempotency_keys.find_one({"_id": record_id})
+    if record is None:
+        # Expired between the insert and the read; treat as a fresh key
+        return await _acquire(db, record_id, fingerprint)
+    if record["status"] == IdempotencyStatus.COMPLETED:
+        return False, record
+    if record["fingerprint"] != fingerprint:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"{IDEMPOTENCY_HEADER} was already used for a different request"
+        )
+
+    # A worker that died mid-request leaves its lock behind; take it over
+    # once it is old enough that the original attempt can't still be running
+    stale_before = now - timedelta(seconds=settings.idempotency_lock_seconds)
+    taken_over = await db.idempotency_keys.update_one(
+        {
+            "_id": record_id,
+            "status": IdempotencyStatus.PROCESSING,
+            "locked_at": {"$lt": stale_before}
+        },
+        {"$set": {"locked_at": now}}
+    )
+    if taken_over.modified_count:
+        return True, None
+
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="A request with this idempotency key is still being processed"
+    )
+
+
+async def run_idempotent(
+    key: Optional[str],
+    scope: str,
+    request_body: Any,
+    status_code: int,
+    handler: Callable[[], Awaitable[Any]]
+) -> Any:
+    """
+    Run `handler` at most once per idempotency key.
+
+    `scope` identifies the caller and endpoint. Without a key the handler
+    simply runs. With one, the first successful result is stored with
+    `status_code` and every repeat gets it back as a JSONResponse.
+    """
+    if key is None:
+        return await handler()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{IDEMPOTENCY_HEADER} must be 1-{MAX_KEY_LENGTH} characters"
+        )
+
+    record_id = f"{scope}:{key}"
+    fingerprint = _fingerprint(request_body)
+
+    cached = _response_cache.get(record_id)
+    if cached is not None:
+        return _replay(cached, fingerprint)
+
+    db = get_database()
+    should_run, record = await _acquire(db, record_id, fingerprint)
+    if not should_run:
+        _response_cache.put(record)
+        return _replay(record, fingerprint)
+
+    try:
+        result = await handler()
+    except BaseException:
+        # Let the client retry with the same key
+        await db.idempotency_keys.delete_one(
+            {"_id": record_id, "status": IdempotencyStatus.PROCESSING}
+        )
+        raise
+
+    now = datetime.utcnow()
+    record = {
+        "_id": record_id,
+        "fingerprint": fingerprint,
+        "status": IdempotencyStatus.COMPLETED,
+        "status_code": status_code,
+        "response_body": jsonable_encoder(result),
+        "expires_at": now + timedelta(seconds=settings.idempotency_ttl_seconds)
+    }
+    try:
+        await db.idempotency_keys.replace_one({"_id": record_id}, record, upsert=True)
+        _response_cache.put(record)
+    except Exception as e:
+        logger.error(f"Failed to store idempotent response for {record_id}: {e}")
+    return result
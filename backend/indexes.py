@@ -0,0 +1,226 @@
+"""
+Declarative index registry and the hot queries it is meant to serve.
+
+`INDEXES` lists every index the application relies on; `ensure_indexes`
+creates them at startup. `HOT_QUERIES` mirrors the filters and sorts the
+routers issue most often, with placeholder values, so `check_indexes.py`
+can run `explain()` on each one and flag any that fall back to a
+collection scan.
+"""
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Stand-ins for IDs and timestamps in the hot query filters; the planner
+# picks an index from the query shape, not the values
+SAMPLE_ID = "000000000000000000000000"
+SAMPLE_TIME = datetime(2000, 1, 1)
+
+# How long finished jobs are kept after `finished_at`
+JOB_RETENTION_SECONDS = 7 * 24 * 3600
+
+
+@dataclass
+class IndexSpec:
+    """One index on one collection."""
+    collection: str
+    keys: List[Tuple[str, Any]]
+    unique: bool = False
+    expire_after_seconds: Optional[int] = None
+
+
+@dataclass
+class HotQuery:
+    """A frequently issued find (or leading $match) to verify with explain()."""
+    name: str
+    collection: str
+    filter: Dict[str, Any]
+    sort: Optional[List[Tuple[str, int]]] = None
+    # Low-selectivity filters where a scan is acceptable
+    allow_collscan: bool = False
+
+
+INDEXES: List[IndexSpec] = [
+    # Users
+    IndexSpec("users", [("email", ASCENDING)], unique=True),
+    IndexSpec("users", [("role", ASCENDING)]),
+
+    # Parking lots; `location` holds GeoJSON points, which $geoNear can
+    # only use through a 2dsphere index
+    IndexSpec("parking_lots", [("location", GEOSPHERE)]),
+    IndexSpec("parking_lots", [("is_active", ASCENDING)]),
+    IndexSpec("parking_lots", [("name", ASCENDING)]),
+
+    # Parking slots: per-lot listings filtered by status, and the slot
+    # number uniqueness check when admins add slots
+    IndexSpec("parking_slots", [("lot_id", ASCENDING), ("status", ASCENDING)]),
+    IndexSpec("parking_slots", [("lot_id", ASCENDING), ("slot_number", ASCENDING)]),
+    # Surge pricing counts slots with a reservation covering the present
+    IndexSpec("parking_slots", [("reservations.end_time", ASCENDING)]),
+
+    # Bookings
+    IndexSpec("bookings", [("user_id", ASCENDING), ("created_at", DESCENDING)]),
+    IndexSpec("bookings", [("slot_id", ASCENDING), ("status", ASCENDING)]),
+    IndexSpec("bookings", [("payment_status", ASCENDING), ("created_at", DESCENDING)]),
+    IndexSpec("bookings", [("lot_id", ASCENDING)]),
+    IndexSpec("bookings", [("start_time", DESCENDING)]),
+    IndexSpec("bookings", [("end_time", DESCENDING)]),
+    # Lifecycle scheduler deadlines
+    IndexSpec("bookings", [("status", ASCENDING), ("start_time", ASCENDING)]),
+    IndexSpec("bookings", [("status", ASCENDING), ("end_time", ASCENDING)]),
+    # Keyset pagination of booking listings, optionally filtered by status;
+    # the second also serves (status, created_at) filters and sorts
+    IndexSpec("bookings", [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    IndexSpec("bookings", [("status", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+
+    # Reviews
+    IndexSpec("reviews", [("lot_id", ASCENDING), ("created_at", DESCENDING)]),
+    IndexSpec("reviews", [("user_id", ASCENDING)]),
+    IndexSpec("reviews", [("created_at", DESCENDING)]),
+
+    # Vehicles
+    IndexSpec("vehicles", [("user_id", ASCENDING)]),
+    IndexSpec("vehicles", [("license_plate", ASCENDING)], unique=True),
+
+    # Payments
+    IndexSpec("payments", [("booking_id", ASCENDING)]),
+    IndexSpec("payments", [("user_id", ASCENDING)]),
+    IndexSpec("payments", [("status", ASCENDING)]),
+
+    # Jobs
+    IndexSpec("jobs", [("status", ASCENDING), ("run_at", ASCENDING)]),
+    # Only finished jobs carry `finished_at`, so only they expire
+    IndexSpec("jobs", [("finished_at", ASCENDING)], expire_after_seconds=JOB_RETENTION_SECONDS),
+
+    # Idempotency keys are removed once their `expires_at` passes
+    IndexSpec("idempotency_keys", [("expires_at", ASCENDING)], expire_after_seconds=0),
+]
+
+# Indexes made redundant by a replacement above, as (collection, name)
+DROPPED_INDEXES: List[Tuple[str, str]] = [
+    # Flat 2d index from before lots stored GeoJSON points
+    ("parking_lots", "location_2d"),
+    # Prefixes of the compound indexes above
+    ("bookings", "user_id_1"),
+    ("bookings", "status_1"),
+    ("reviews", "lot_id_1"),
+]
+
+_LIVE = {"$in": ["pending", "confirmed", "active"]}
+
+HOT_QUERIES: List[HotQuery] = [
+    # Bookings
+    HotQuery("user booking list", "bookings",
+             {"user_id": SAMPLE_ID}, [("created_at", -1)]),
+    HotQuery("user booking list by status", "bookings",
+             {"user_id": SAMPLE_ID, "status": "confirmed"}, [("created_at", -1)]),
+    HotQuery("admin booking list", "bookings",
+             {}, [("created_at", -1), ("_id", -1)]),
+    HotQuery("admin booking list by status", "bookings",
+             {"status": "confirmed"}, [("created_at", -1), ("_id", -1)]),
+    HotQuery("live bookings on a slot", "bookings",
+             {"slot_id": SAMPLE_ID, "status": _LIVE, "end_time": {"$gt": SAMPLE_TIME}}),
+    HotQuery("live bookings in a lot", "bookings",
+             {"lot_id": SAMPLE_ID, "status": _LIVE, "end_time": {"$gt": SAMPLE_TIME}}),
+    HotQuery("paid revenue since", "bookings",
+             {"payment_status": "paid", "created_at": {"$gte": SAMPLE_TIME}}),
+    HotQuery("user paid revenue", "bookings",
+             {"user_id": SAMPLE_ID, "payment_status": "paid"}),
+    HotQuery("user completed booking at lot", "bookings",
+             {"user_id": SAMPLE_ID, "lot_id": SAMPLE_ID, "status": "completed"}),
+    HotQuery("bookings due to activate", "bookings",
+             {"status": {"$in": ["pending", "confirmed"]}, "start_time": {"$lte": SAMPLE_TIME}}),
+    HotQuery("bookings due to complete", "bookings",
+             {"status": _LIVE, "end_time": {"$lte": SAMPLE_TIME}}),
+
+    # Parking slots
+    HotQuery("lot slots", "parking_slots", {"lot_id": SAMPLE_ID}),
+    HotQuery("lot slots by status", "parking_slots",
+             {"lot_id": SAMPLE_ID, "status": "available"}),
+    HotQuery("slot number lookup", "parking_slots",
+             {"lot_id": SAMPLE_ID, "slot_number": "A1"}),
+    HotQuery("search candidate slots", "parking_slots",
+             {"lot_id": {"$in": [SAMPLE_ID]}, "status": {"$ne": "maintenance"}}),
+    HotQuery("currently occupied slots", "parking_slots",
+             {"reservations": {"$elemMatch": {"start_time": {"$lte": SAMPLE_TIME},
+                                               "end_time": {"$gt": SAMPLE_TIME}}}}),
+
+    # Reviews
+    HotQuery("lot reviews", "reviews",
+             {"lot_id": SAMPLE_ID}, [("created_at", -1)]),
+    HotQuery("user review of lot", "reviews",
+             {"user_id": SAMPLE_ID, "lot_id": SAMPLE_ID}),
+
+    # Others
+    HotQuery("login by email", "users", {"email": "user@example.com"}),
+    HotQuery("user vehicles", "vehicles", {"user_id": SAMPLE_ID}),
+    HotQuery("active lots", "parking_lots", {"is_active": True}, allow_collscan=True),
+    HotQuery("queued jobs", "jobs", {"status": "queued"}),
+]
+
+
+def index_name(keys: List[Tuple[str, Any]]) -> str:
+    """The name MongoDB gives an index with these keys by default."""
+    return "_".join(f"{name}_{direction}" for name, direction in keys)
+
+
+async def ensure_indexes(db) -> None:
+    """Create every registered index and drop superseded ones."""
+    for collection, name in DROPPED_INDEXES:
+        try:
+            await db[collection].drop_index(name)
+            logger.info(f"Dropped superseded index {collection}.{name}")
+        except OperationFailure:
+            pass
+
+    for spec in INDEXES:
+        try:
+            options = {"unique": spec.unique}
+            if spec.expire_after_seconds is not None:
+                options["expireAfterSeconds"] = spec.expire_after_seconds
+            await db[spec.collection].create_index(spec.keys, **options)
+        except OperationFailure as e:
+            # Keep going so one bad index (e.g. duplicate data behind a
+            # unique key) doesn't leave the rest missing
+            logger.error(f"Error creating index {spec.collection}.{index_name(spec.keys)}: {e}")
+
+
+def _plan_stages(plan: Any) -> List[dict]:
+    """Flatten an explain() plan tree into its stages."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan)
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_plan_stages(value))
+    return stages
+
+
+async def explain_query(db, query: HotQuery) -> dict:
+    """
+    Run explain() on a hot query.
+
+    Returns the winning plan's collection-scan flag, the indexes it uses
+    and whether an in-memory sort was needed.
+    """
+    command = {"find": query.collection, "filter": query.filter}
+    if query.sort:
+        command["sort"] = dict(query.sort)
+    result = await db.command({"explain": command, "verbosity": "queryPlanner"})
+
+    stages = _plan_stages(result["queryPlanner"]["winningPlan"])
+    stage_names = {stage["stage"] for stage in stages}
+    return {
+        "collscan": "COLLSCAN" in stage_names,
+        "indexes": sorted({stage["indexName"] for stage in stages if "indexName" in stage}),
+        "in_memory_sort": "SORT" in stage_names,
+    }
@@ -0,0 +1,183 @@
+"""
+In-process background job queue with persisted job state.
+
+Jobs are written to the `jobs` collection before they are queued, run by
+a bounded pool of asyncio workers and retried with exponential backoff.
+Queued jobs, and running jobs whose lease has expired, are picked up
+again on startup, each at its own `run_at`, so work (including pending
+retries) survives restarts. Finished jobs are removed a week after they
+complete by a TTL index on `finished_at`.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from config import settings
+from database import get_database
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class JobStatus:
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class JobQueue:
+    """Bounded asyncio worker pool running persisted jobs."""
+
+    def __init__(self):
+        self._handlers: Dict[str, JobHandler] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._retry_timers: List[asyncio.TimerHandle] = []
+
+    def handler(self, job_type: str) -> Callable[[JobHandler], JobHandler]:
+        """Register a coroutine as the handler for a job type."""
+        def register(func: JobHandler) -> JobHandler:
+            self._handlers[job_type] = func
+            return func
+        return register
+
+    async def start(self) -> None:
+        """Start the workers and requeue unfinished jobs."""
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker(index))
+            for index in range(settings.job_workers)
+        ]
+
+        db = get_database()
+        stale_lease = datetime.utcnow() - timedelta(seconds=settings.job_lease_seconds)
+        await db.jobs.update_many(
+            {"status": JobStatus.RUNNING, "updated_at": {"$lt": stale_lease}},
+            {"$set": {"status": JobStatus.QUEUED, "updated_at": datetime.utcnow()}}
+        )
+        pending = await db.jobs.find(
+            {"status": JobStatus.QUEUED},
+            {"_id": 1, "run_at": 1}
+        ).to_list(length=None)
+        now = datetime.utcnow()
+        for job in pending:
+            run_at = job.get("run_at") or now
+            self._schedule(job["_id"], (run_at - now).total_seconds())
+
+        logger.info(f"Job queue started with {len(self._workers)} workers, {len(pending)} jobs recovered")
+
+    async def stop(self) -> None:
+        """Stop the workers; unfinished jobs stay queued for the next start."""
+        for timer in self._retry_timers:
+            timer.cancel()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._retry_timers = []
+        logger.info("Job queue stopped")
+
+    async def enqueue(self, job_type: str, payload: Dict[str, Any]) -> str:
+        """Persist a job and hand it to the workers."""
+        if job_type not in self._handlers:
+            raise ValueError(f"No handler registered for job type '{job_type}'")
+
+        now = datetime.utcnow()
+        result = await get_database().jobs.insert_one({
+            "type": job_type,
+            "payload": payload,
+            "status": JobStatus.QUEUED,
+            "attempts": 0,
+            "last_error": None,
+            "run_at": now,
+            "created_at": now,
+            "updated_at": now
+        })
+        if self._queue is not None:
+            self._queue.put_nowait(result.inserted_id)
+        return str(result.inserted_id)
+
+    def _schedule(self, job_id: ObjectId, delay: float) -> None:
+        """Queue a job now, or after `delay` seconds."""
+        if delay <= 0:
+            self._queue.put_nowait(job_id)
+            return
+        loop = asyncio.get_running_loop()
+        timer = loop.call_later(delay, self._queue.put_nowait, job_id)
+        self._retry_timers = [t for t in self._retry_timers if t.when() > loop.time()] + [timer]
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as err:
+                logger.error(f"Job worker {index} failed on job {job_id}: {err}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: ObjectId) -> None:
+        db = get_database()
+
+        # Claim the job so a second worker or process never runs it twice
+        job = await db.jobs.find_one_and_update(
+            {"_id": job_id, "status": JobStatus.QUEUED},
+            {
+                "$set": {"status": JobStatus.RUNNING, "updated_at": datetime.utcnow()},
+                "$inc": {"attempts": 1}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if not job:
+            return
+
+        handler = self._handlers.get(job["type"])
+        try:
+            if handler is None:
+                raise RuntimeError(f"No handler registered for job type '{job['type']}'")
+            await handler(job["payload"])
+        except Exception as err:
+            await self._handle_failure(job, err)
+            return
+
+        now = datetime.utcnow()
+        await db.jobs.update_one(
+            {"_id": job_id},
+            {"$set": {"status": JobStatus.DONE, "last_error": None, "updated_at": now, "finished_at": now}}
+        )
+
+    async def _handle_failure(self, job: dict, err: Exception) -> None:
+        db = get_database()
+        attempts = job["attempts"]
+
+        if attempts >= settings.job_max_attempts:
+            logger.error(f"Job {job['_id']} ({job['type']}) failed permanently: {err}")
+            await db.jobs.update_one(
+                {"_id": job["_id"]},
+                {"$set": {"status": JobStatus.FAILED, "last_error": str(err), "updated_at": datetime.utcnow()}}
+            )
+            return
+
+        delay = settings.job_retry_base_seconds * 2 ** (attempts - 1)
+        logger.warning(f"Job {job['_id']} ({job['type']}) failed, retrying in {delay:.0f}s: {err}")
+        await db.jobs.update_one(
+            {"_id": job["_id"]},
+            {
+                "$set": {
+                    "status": JobStatus.QUEUED,
+                    "last_error": str(err),
+                    "run_at": datetime.utcnow() + timedelta(seconds=delay),
+                    "updated_at": datetime.utcnow()
+                }
+            }
+        )
+        self._schedule(job["_id"], delay)
+
+
+job_queue = JobQueue()
@@ -0,0 +1,263 @@
+"""
+Background scheduler moving bookings through their lifecycle.
+
+Live bookings become ACTIVE once their start time passes and COMPLETED
+once their end time passes, which releases their slot reservation and
+gives the slot back to its lot's available count. Unpaid PENDING
+bookings can optionally be cancelled after `pending_expiry_minutes`.
+
+Rather than polling the bookings collection, the scheduler loads the
+deadlines falling within `lifecycle_horizon_seconds` into a heap, using
+the (status, start_time) and (status, end_time) indexes, and sleeps
+until the earliest one. Bookings created or extended in between are
+pushed in through `track()`. Every transition is a conditional batched
+update, so stale heap entries and other workers running the same
+scheduler are harmless.
+"""
+import asyncio
+import heapq
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from booking_index import booking_index, LIVE_BOOKING_STATUSES
+from config import settings
+from database import get_database
+from models import BookingStatus, PaymentStatus
+from reservations import release_slot
+from utils import to_naive_utc
+
+logger = logging.getLogger(__name__)
+
+
+class Transition:
+    EXPIRE = "expire"
+    COMPLETE = "complete"
+    ACTIVATE = "activate"
+
+
+# Order in which due transitions are applied within one tick
+TRANSITION_ORDER = [Transition.EXPIRE, Transition.COMPLETE, Transition.ACTIVATE]
+RETRY_SECONDS = 30
+
+
+class LifecycleScheduler:
+    """Deadline heap plus the loop that applies due transitions."""
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, str, str]] = []
+        self._scheduled: Set[Tuple[datetime, str, str]] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._horizon_end: Optional[datetime] = None
+
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info("Booking lifecycle scheduler started")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            logger.info("Booking lifecycle scheduler stopped")
+
+    def track(self, booking: dict) -> None:
+        """Schedule the deadlines of a booking that was just created or changed."""
+        if self._task is None:
+            return
+        earliest = self._heap[0][0] if self._heap else None
+        self._push_deadlines(booking)
+        if self._heap and (earliest is None or self._heap[0][0] < earliest):
+            self._wakeup.set()
+
+    def _push(self, deadline: datetime, transition: str, booking_id: str) -> None:
+        entry = (deadline, transition, booking_id)
+        if entry in self._scheduled:
+            return
+        # Only the loaded window is held in memory; the next refresh
+        # picks up anything further out
+        if self._horizon_end is not None and deadline > self._horizon_end:
+            return
+        self._scheduled.add(entry)
+        heapq.heappush(self._heap, entry)
+
+    def _push_deadlines(self, booking: dict) -> None:
+        booking_id = str(booking["_id"])
+        booking_status = booking.get("status")
+        if booking_status not in LIVE_BOOKING_STATUSES:
+            return
+
+        self._push(to_naive_utc(booking["end_time"]), Transition.COMPLETE, booking_id)
+        if booking_status != BookingStatus.ACTIVE:
+            self._push(to_naive_utc(booking["start_time"]), Transition.ACTIVATE, booking_id)
+        if booking_status == BookingStatus.PENDING and settings.pending_expiry_minutes:
+            expires_at = booking["created_at"] + timedelta(minutes=settings.pending_expiry_minutes)
+            self._push(expires_at, Transition.EXPIRE, booking_id)
+
+    async def _refresh(self, db) -> None:
+        """Load every deadline up to the end of the next horizon."""
+        now = datetime.utcnow()
+        horizon_end = now + timedelta(seconds=settings.lifecycle_horizon_seconds)
+        conditions = [
+            {
+                "status": {"$in": [BookingStatus.PENDING, BookingStatus.CONFIRMED]},
+                "start_time": {"$lte": horizon_end}
+            },
+            {
+                "status": {"$in": LIVE_BOOKING_STATUSES},
+                "end_time": {"$lte": horizon_end}
+            },
+        ]
+        if settings.pending_expiry_minutes:
+            conditions.append({
+                "status": BookingStatus.PENDING,
+                "created_at": {
+                    "$lte": horizon_end - timedelta(minutes=settings.pending_expiry_minutes)
+                }
+            })
+
+        bookings = await db.bookings.find(
+            {"$or": conditions},
+            {"status": 1, "start_time": 1, "end_time": 1, "created_at": 1}
+        ).to_list(length=None)
+
+        self._horizon_end = horizon_end
+        for booking in bookings:
+            self._push_deadlines(booking)
+        logger.debug(f"Lifecycle scheduler loaded {len(bookings)} bookings with upcoming deadlines")
+
+    def _pop_due(self, now: datetime) -> Dict[str, List[ObjectId]]:
+        due: Dict[str, List[ObjectId]] = defaultdict(list)
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            self._scheduled.discard(entry)
+            _, transition, booking_id = entry
+            due[transition].append(ObjectId(booking_id))
+        return due
+
+    async def _run(self) -> None:
+        db = get_database()
+        while True:
+            try:
+                if self._horizon_end is None or datetime.utcnow() >= self._refresh_at():
+                    await self._refresh(db)
+                await self._apply_due(db)
+            except Exception as err:
+                logger.error(f"Lifecycle scheduler tick failed: {err}")
+
+            if self._horizon_end is None:
+                # The first refresh failed; try again shortly
+                timeout = RETRY_SECONDS
+            else:
+                wake_at = self._refresh_at()
+                if self._heap:
+                    wake_at = min(wake_at, self._heap[0][0])
+                timeout = max((wake_at - datetime.utcnow()).total_seconds(), 0)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _refresh_at(self) -> datetime:
+        # Reload halfway through the window so the heap never runs dry
+        return self._horizon_end - timedelta(seconds=settings.lifecycle_horizon_seconds / 2)
+
+    async def _apply_due(self, db) -> None:
+        due = self._pop_due(datetime.utcnow())
+        for transition in TRANSITION_ORDER:
+            booking_ids = due.get(transition, [])
+            for offset in range(0, len(booking_ids), settings.lifecycle_batch_size):
+                batch = booking_ids[offset:offset + settings.lifecycle_batch_size]
+                if transition == Transition.ACTIVATE:
+                    await self._activate(db, batch)
+                elif transition == Transition.COMPLETE:
+                    await self._finish(db, batch, BookingStatus.COMPLETED, {
+                        "status": {"$in": LIVE_BOOKING_STATUSES},
+                        "end_time": {"$lte": datetime.utcnow()}
+                    })
+                else:
+                    await self._finish(db, batch, BookingStatus.CANCELLED, {
+                        "status": BookingStatus.PENDING,
+                        "payment_status": {"$ne": PaymentStatus.PAID},
+                        "created_at": {
+                            "$lte": datetime.utcnow() - timedelta(minutes=settings.pending_expiry_minutes)
+                        }
+                    })
+
+    async def _activate(self, db, booking_ids: List[ObjectId]) -> None:
+        now = datetime.utcnow()
+        result = await db.bookings.update_many(
+            {
+                "_id": {"$in": booking_ids},
+                "status": {"$in": [BookingStatus.PENDING, BookingStatus.CONFIRMED]},
+                "start_time": {"$lte": now},
+                "end_time": {"$gt": now}
+            },
+            {"$set": {"status": BookingStatus.ACTIVE, "updated_at": now}}
+        )
+        if result.modified_count:
+            logger.info(f"Activated {result.modified_count} bookings")
+
+    async def _finish(
+        self,
+        db,
+        booking_ids: List[ObjectId],
+        final_status: BookingStatus,
+        condition: dict
+    ) -> None:
+        """Move bookings matching `condition` to a final status and release their slots."""
+        # MongoDB keeps milliseconds, so truncate to be able to match it back
+        now = datetime.utcnow()
+        now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+        result = await db.bookings.update_many(
+            {"_id": {"$in": booking_ids}, **condition},
+            {"$set": {"status": final_status, "updated_at": now}}
+        )
+        if not result.modified_count:
+            return
+
+        # The update stamp singles out the bookings this call moved
+        finished = await db.bookings.find(
+            {"_id": {"$in": booking_ids}, "status": final_status, "updated_at": now},
+            {"lot_id": 1, "slot_id": 1}
+        ).to_list(length=None)
+
+        # Release one booking at a time so each release's pre-image shows
+        # whether it, and no concurrent claim or release, freed the slot
+        freed = await asyncio.gather(*(
+            release_slot(db, booking["slot_id"], str(booking["_id"]))
+            for booking in finished
+        ))
+        freed_per_lot = Counter(
+            booking["lot_id"]
+            for booking, slot_freed in zip(finished, freed)
+            if slot_freed
+        )
+        if freed_per_lot:
+            await db.parking_lots.bulk_write([
+                UpdateOne(
+                    {"_id": ObjectId(lot_id)},
+                    {"$inc": {"available_slots": freed}, "$set": {"updated_at": now}}
+                )
+                for lot_id, freed in freed_per_lot.items()
+            ], ordered=False)
+
+        for booking in finished:
+            booking_index.remove(str(booking["_id"]))
+
+        logger.info(
+            f"Moved {len(finished)} bookings to {final_status.value}, "
+            f"freeing {sum(freed_per_lot.values())} slots"
+        )
+
+
+lifecycle_scheduler = LifecycleScheduler()
@@ -0,0 +1,94 @@
+"""
+Request-scoped batching of find-by-ID lookups.
+
+A loader collects every `load()` issued during the same event-loop tick,
+dedupes the IDs and resolves them with a single `$in` query, so code can
+fetch related documents one at a time without paying a round trip per
+document. Results are cached for the rest of the request. Routers get a
+fresh set through the `get_loaders` dependency.
+"""
+import asyncio
+from typing import Dict, Iterable, List, Optional
+
+from bson import ObjectId
+
+from database import get_database
+
+
+class DocumentLoader:
+    """Batches `_id` lookups against one collection."""
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._pending: List[str] = []
+        self._tasks = set()
+
+    def load(self, doc_id: str) -> "asyncio.Future[Optional[dict]]":
+        """
+        Return a future resolving to the document with this ID, or None.
+
+        Raises bson.errors.InvalidId through the future for malformed IDs.
+        """
+        key = str(doc_id)
+        future = self._futures.get(key)
+        if future is not None:
+            return future
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._futures[key] = future
+        if not self._pending:
+            # Wait one extra iteration so tasks created alongside this call
+            # (e.g. by gather) get to queue their IDs before the batch goes out
+            loop.call_soon(loop.call_soon, self._dispatch)
+        self._pending.append(key)
+        return future
+
+    async def load_many(self, doc_ids: Iterable[str]) -> List[Optional[dict]]:
+        """Load several documents in one batch, keeping the input order."""
+        return await asyncio.gather(*(self.load(doc_id) for doc_id in doc_ids))
+
+    def _dispatch(self) -> None:
+        keys, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._fetch(keys))
+        # Hold a reference so the task isn't garbage collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fetch(self, keys: List[str]) -> None:
+        object_ids = {}
+        for key in keys:
+            try:
+                object_ids[key] = ObjectId(key)
+            except Exception as err:
+                self._futures[key].set_exception(err)
+
+        try:
+            docs = await self._collection.find(
+                {"_id": {"$in": list(object_ids.values())}}
+            ).to_list(length=None) if object_ids else []
+        except Exception as err:
+            for key in object_ids:
+                # Forget failures so a later load retries instead of re-raising
+                self._futures.pop(key).set_exception(err)
+            return
+
+        found = {str(doc["_id"]): doc for doc in docs}
+        for key in object_ids:
+            self._futures[key].set_result(found.get(key))
+
+
+class Loaders:
+    """One loader per collection that routers look up by ID."""
+
+    def __init__(self, db):
+        self.users = DocumentLoader(db.users)
+        self.lots = DocumentLoader(db.parking_lots)
+        self.slots = DocumentLoader(db.parking_slots)
+        self.vehicles = DocumentLoader(db.vehicles)
+
+
+def get_loaders() -> Loaders:
+    """FastAPI dependency giving each request its own loaders."""
+    return Loaders(get_database())
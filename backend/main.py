@@ -7,7 +7,14 @@ from contextlib import asynccontextmanager
 import logging
 
 from config import settings
-from database import connect_to_mongo, close_mongo_connection
+from database import connect_to_mongo, close_mongo_connection, get_database
+from auth import password_hasher
+from jobs import job_queue
+from lifecycle import lifecycle_scheduler
+from pricing import surge_pricing
+from reconciliation import slot_counter_reconciler
+from rendering import render_service
+from spatial_index import lot_index
 from routers import (
     auth_router,
     parking_router,
@@ -33,12 +40,31 @@ async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting ParkEasy Backend API...")
     await connect_to_mongo()
+    if settings.lot_index_enabled:
+        await lot_index.ensure_loaded(get_database())
+    render_service.start()
+    password_hasher.start()
+    if settings.bcrypt_target_ms:
+        await password_hasher.calibrate()
+    await job_queue.start()
+    if settings.lifecycle_enabled:
+        await lifecycle_scheduler.start()
+    if settings.reconcile_interval_seconds:
+        await slot_counter_reconciler.start()
+    if settings.surge_enabled:
+        await surge_pricing.start()
     logger.info("Application started successfully")
     
     yield
     
     # Shutdown
     logger.info("Shutting down ParkEasy Backend API...")
+    await surge_pricing.stop()
+    await slot_counter_reconciler.stop()
+    await lifecycle_scheduler.stop()
+    await job_queue.stop()
+    password_hasher.stop()
+    render_service.stop()
     await close_mongo_connection()
     logger.info("Application shut down successfully")
 
@@ -58,6 +84,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed"],
 )
 
 # Include routers
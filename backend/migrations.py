@@ -0,0 +1,88 @@
+"""
+One-off data migrations run at startup.
+
+Each migration runs once per database. Its name is recorded in the
+`migrations` collection before it starts, so other workers starting at
+the same time skip it, and the record is removed again if it fails so
+the next startup retries. Migrations must be idempotent, since a worker
+that dies midway leaves one half applied.
+"""
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, List, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from booking_index import LIVE_BOOKING_STATUSES
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+async def backfill_slot_reservations(db) -> None:
+    """Mirror live bookings made before slots tracked reservations."""
+    now = datetime.utcnow()
+    cursor = db.bookings.find(
+        {"status": {"$in": LIVE_BOOKING_STATUSES}, "end_time": {"$gt": now}},
+        {"slot_id": 1, "start_time": 1, "end_time": 1}
+    )
+
+    writes = []
+    backfilled = 0
+    async for booking in cursor:
+        booking_id = str(booking["_id"])
+        writes.append(UpdateOne(
+            {"_id": ObjectId(booking["slot_id"]), "reservations.booking_id": {"$ne": booking_id}},
+            {"$push": {"reservations": {
+                "booking_id": booking_id,
+                "start_time": booking["start_time"],
+                "end_time": booking["end_time"]
+            }}}
+        ))
+        if len(writes) >= BACKFILL_BATCH_SIZE:
+            backfilled += (await db.parking_slots.bulk_write(writes, ordered=False)).modified_count
+            writes = []
+    if writes:
+        backfilled += (await db.parking_slots.bulk_write(writes, ordered=False)).modified_count
+
+    logger.info(f"Backfilled {backfilled} slot reservations from live bookings")
+
+
+async def drop_legacy_qr_images(db) -> None:
+    """Remove base64 QR images stored on older bookings; they are now rendered on demand."""
+    result = await db.bookings.update_many(
+        {"qr_code": {"$exists": True}},
+        {"$unset": {"qr_code": ""}}
+    )
+    logger.info(f"Dropped stored QR images from {result.modified_count} bookings")
+
+
+# Run in order; append new migrations at the end and never rename one
+MIGRATIONS: List[Tuple[str, Callable[[object], Awaitable[None]]]] = [
+    ("backfill_slot_reservations", backfill_slot_reservations),
+    ("drop_legacy_qr_images", drop_legacy_qr_images),
+]
+
+
+async def run_migrations(db) -> None:
+    """Apply every migration this database has not seen yet."""
+    for name, migration in MIGRATIONS:
+        try:
+            await db.migrations.insert_one({"_id": name, "started_at": datetime.utcnow()})
+        except DuplicateKeyError:
+            continue
+
+        try:
+            await migration(db)
+        except Exception as e:
+            await db.migrations.delete_one({"_id": name})
+            logger.error(f"Migration {name} failed: {e}")
+            continue
+        await db.migrations.update_one(
+            {"_id": name},
+            {"$set": {"finished_at": datetime.utcnow()}}
+        )
+        logger.info(f"Applied migration {name}")
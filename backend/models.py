@@ -107,13 +107,39 @@ class ParkingSlot(BaseModel):
     floor_level: int = 1
 
 
+BAND_TIME_PATTERN = r"^(([01][0-9]|2[0-3]):[0-5][0-9]|24:00)$"
+
+
+class TariffBand(BaseModel):
+    """A rate applying on some weekdays between two local times."""
+    name: Optional[str] = None  # e.g. "peak", "night", "weekend"
+    days: List[int] = Field(..., min_length=1)  # 0 = Monday ... 6 = Sunday
+    start: str = Field(..., pattern=BAND_TIME_PATTERN)  # "HH:MM"
+    # "HH:MM"; earlier than start runs past midnight, "24:00" ends the day
+    end: str = Field(..., pattern=BAND_TIME_PATTERN)
+    price_per_hour: float = Field(..., ge=0)
+    
+    @validator('days')
+    def days_must_be_weekdays(cls, v):
+        if any(day < 0 or day > 6 for day in v):
+            raise ValueError('days must be between 0 (Monday) and 6 (Sunday)')
+        return sorted(set(v))
+    
+    @validator('end')
+    def end_must_differ_from_start(cls, v, values):
+        if v == values.get('start'):
+            raise ValueError('end must differ from start')
+        return v
+
+
 class ParkingLotBase(BaseModel):
     name: str
     address: str
     latitude: float = Field(..., ge=-90, le=90)
     longitude: float = Field(..., ge=-180, le=180)
     total_slots: int = Field(..., ge=0)
-    price_per_hour: float = Field(..., ge=0)
+    price_per_hour: float = Field(..., ge=0)  # charged outside every tariff band
+    tariffs: List[TariffBand] = []  # later bands win where bands overlap
     operating_hours: str = "24/7"
     amenities: List[str] = []
     image_url: Optional[str] = None
@@ -129,6 +155,7 @@ class ParkingLotUpdate(BaseModel):
     latitude: Optional[float] = Field(None, ge=-90, le=90)
     longitude: Optional[float] = Field(None, ge=-180, le=180)
     price_per_hour: Optional[float] = Field(None, ge=0)
+    tariffs: Optional[List[TariffBand]] = None
     operating_hours: Optional[str] = None
     amenities: Optional[List[str]] = None
     image_url: Optional[str] = None
@@ -142,6 +169,7 @@ class ParkingLotResponse(ParkingLotBase):
     rating: Optional[float] = None
     total_reviews: int = 0
     created_at: datetime
+    distance: Optional[float] = None  # km, set on location-based searches
     
     class Config:
         from_attributes = True
@@ -224,7 +252,7 @@ class BookingReceipt(BaseModel):
     payment_status: PaymentStatus
     total_price: float
     created_at: datetime
-    qr_code: Optional[str] = None
+    qr_code: Optional[str] = None  # signed QR payload, not an image
 
 
 class BookingResponse(BookingBase):
@@ -233,7 +261,7 @@ class BookingResponse(BookingBase):
     status: BookingStatus
     total_price: float
     payment_status: PaymentStatus
-    qr_code: Optional[str] = None
+    qr_code: Optional[str] = None  # signed QR payload; image at /api/bookings/{id}/qr
     created_at: datetime
     updated_at: datetime
     receipt: Optional[BookingReceipt] = None
@@ -247,6 +275,23 @@ class BookingWithDetails(BookingResponse):
     vehicle: Optional[VehicleResponse] = None
 
 
+class BulkBookingCreate(BaseModel):
+    bookings: List[BookingCreate] = Field(..., min_length=1, max_length=100)
+
+
+class BulkBookingItemResult(BaseModel):
+    index: int  # position in the request's `bookings` list
+    status_code: int
+    booking: Optional[BookingResponse] = None
+    error: Optional[str] = None
+
+
+class BulkBookingResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkBookingItemResult]
+
+
 # Review Models
 class ReviewBase(BaseModel):
     lot_id: str
@@ -327,4 +372,45 @@ class ParkingSearchQuery(BaseModel):
     end_time: Optional[datetime] = None
     slot_type: Optional[SlotType] = None
     min_price: Optional[float] = None
-    max_price: Optional[float] = None
\ No newline at end of file
+    max_price: Optional[float] = None
+
+
+class ParkingLotAvailability(ParkingLotResponse):
+    free_slots: int
+    free_slot_ids: List[str] = []
+
+
+class PriceQuote(BaseModel):
+    lot_id: str
+    start_time: datetime
+    end_time: datetime
+    price_per_hour: float
+    surge_multiplier: float
+    occupancy: float
+    total_price: float
+    surge_computed_at: Optional[datetime] = None
+
+
+class QuoteWindow(BaseModel):
+    start_time: datetime
+    end_time: datetime
+    
+    @validator('end_time')
+    def end_time_must_be_after_start_time(cls, v, values):
+        if 'start_time' in values and v <= values['start_time']:
+            raise ValueError('end_time must be after start_time')
+        return v
+
+
+class PriceMatrixRequest(BaseModel):
+    lot_ids: List[str] = Field(..., min_length=1, max_length=500)
+    windows: List[QuoteWindow] = Field(..., min_length=1, max_length=50)
+
+
+class PriceMatrixResponse(BaseModel):
+    lot_ids: List[str]
+    windows: List[QuoteWindow]
+    surge_multipliers: List[Optional[float]]
+    # prices[i][j] is lot i over window j; None for unknown lots
+    prices: List[List[Optional[float]]]
+    surge_computed_at: Optional[datetime] = None
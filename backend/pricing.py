@@ -0,0 +1,207 @@
+"""
+Occupancy-driven surge pricing.
+
+Every `surge_refresh_seconds` the engine recomputes a multiplier per lot
+from two signals: how full the lot is right now, and how fast it is
+being booked (bookings created per slot per hour over the last
+`surge_velocity_window_minutes`). Occupancy counts the slots holding a
+reservation that covers the current moment, not `available_slots`,
+which drops as soon as a slot holds any future reservation. The results
+are held in memory, so pricing a booking or a quote is a dictionary
+lookup. Lots the engine has not seen yet, and every lot when surge
+pricing is disabled, price at 1.0.
+
+The engine also caches each lot's `price_per_hour` and compiled tariff
+for the quote matrix endpoint, which prices many lots over many windows
+at once with NumPy. Cached rates can lag an edit made on another worker
+by one refresh.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from bson import ObjectId
+
+from config import settings
+from database import get_database
+from tariffs import CompiledTariff, compiled_tariff, week_minutes
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class LotSurge:
+    """Precomputed surge state of one lot."""
+    multiplier: float
+    occupancy: float
+    velocity: float  # bookings per slot per hour
+
+
+NO_SURGE = LotSurge(multiplier=1.0, occupancy=0.0, velocity=0.0)
+
+# A lot's flat hourly price and compiled tariff (None for flat-rate lots)
+LotRates = Tuple[float, Optional[CompiledTariff]]
+
+
+def surge_multiplier(occupancy: float, velocity: float) -> float:
+    """
+    Combine occupancy and booking velocity into a price multiplier.
+
+    Occupancy adds nothing up to `surge_occupancy_threshold` and then
+    rises linearly to `surge_max_multiplier` at a full lot. Velocity
+    scales that by `surge_velocity_weight` per booking per slot per hour.
+    The result is capped and rounded so prices don't jitter.
+    """
+    threshold = settings.surge_occupancy_threshold
+    max_multiplier = settings.surge_max_multiplier
+
+    occupancy_factor = 1.0
+    if occupancy > threshold and threshold < 1:
+        occupancy_factor += (max_multiplier - 1) * (occupancy - threshold) / (1 - threshold)
+    velocity_factor = 1.0 + settings.surge_velocity_weight * velocity
+
+    return round(min(max_multiplier, occupancy_factor * velocity_factor), 2)
+
+
+def price_matrix(
+    rates: List[LotRates],
+    multipliers: np.ndarray,
+    windows: List[Tuple[datetime, datetime]]
+) -> np.ndarray:
+    """
+    Price every lot over every window in one pass.
+
+    Takes per-lot rates and multipliers (length N) and (start, end)
+    windows (length M); returns the N x M totals, applying the same
+    one-hour minimum and rounding as `calculate_parking_price`.
+    """
+    starts = [start for start, _ in windows]
+    billed_ends = [max(end, start + timedelta(hours=1)) for start, end in windows]
+    billed_hours = np.array([
+        (end - start).total_seconds() / 3600
+        for start, end in zip(starts, billed_ends)
+    ])
+
+    # Same operation order as the scalar version so results match exactly
+    base_prices = np.outer([price for price, _ in rates], billed_hours)
+    tariffed = [row for row, (_, tariff) in enumerate(rates) if tariff is not None]
+    if tariffed:
+        start_minutes, end_minutes = week_minutes(starts), week_minutes(billed_ends)
+        for row in tariffed:
+            base_prices[row] = rates[row][1].cost_many(start_minutes, end_minutes)
+    return np.round(base_prices * multipliers[:, None], 2)
+
+
+class SurgePricingEngine:
+    """In-memory per-lot multipliers refreshed on a fixed interval."""
+
+    def __init__(self):
+        self._surges: Dict[str, LotSurge] = {}
+        self._rates: Dict[str, LotRates] = {}
+        self._computed_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def computed_at(self) -> Optional[datetime]:
+        return self._computed_at
+
+    def surge(self, lot_id: str) -> LotSurge:
+        """Current surge state of a lot."""
+        if not settings.surge_enabled:
+            return NO_SURGE
+        return self._surges.get(lot_id, NO_SURGE)
+
+    def multiplier(self, lot_id: str) -> float:
+        """Current price multiplier of a lot."""
+        return self.surge(lot_id).multiplier
+
+    async def refresh(self, db) -> None:
+        """Recompute every active lot's multiplier."""
+        window = timedelta(minutes=settings.surge_velocity_window_minutes)
+        now = datetime.utcnow()
+
+        lots = await db.parking_lots.find(
+            {"is_active": True},
+            {"total_slots": 1, "price_per_hour": 1, "tariffs": 1}
+        ).to_list(length=None)
+        occupied = await db.parking_slots.aggregate([
+            {"$match": {"reservations": {"$elemMatch": {
+                "start_time": {"$lte": now},
+                "end_time": {"$gt": now}
+            }}}},
+            {"$group": {"_id": "$lot_id", "count": {"$sum": 1}}}
+        ]).to_list(length=None)
+        occupied_counts = {row["_id"]: row["count"] for row in occupied}
+        recent = await db.bookings.aggregate([
+            {"$match": {"created_at": {"$gte": now - window}}},
+            {"$group": {"_id": "$lot_id", "count": {"$sum": 1}}}
+        ]).to_list(length=None)
+        recent_counts = {row["_id"]: row["count"] for row in recent}
+
+        window_hours = window.total_seconds() / 3600
+        surges = {}
+        rates = {}
+        for lot in lots:
+            lot_id = str(lot["_id"])
+            rates[lot_id] = (lot["price_per_hour"], compiled_tariff(lot))
+            total = lot.get("total_slots", 0)
+            if total <= 0:
+                continue
+            occupancy = min(occupied_counts.get(lot_id, 0), total) / total
+            velocity = recent_counts.get(lot_id, 0) / total / window_hours
+            surges[lot_id] = LotSurge(
+                multiplier=surge_multiplier(occupancy, velocity),
+                occupancy=round(occupancy, 4),
+                velocity=round(velocity, 4)
+            )
+
+        # Swap in one assignment so lookups never see a half-built table
+        self._surges = surges
+        self._rates = rates
+        self._computed_at = now
+        surging = sum(1 for surge in surges.values() if surge.multiplier > 1)
+        logger.debug(f"Surge multipliers refreshed for {len(surges)} lots, {surging} surging")
+
+    def set_rates(self, lot_id: str, lot: Optional[dict]) -> None:
+        """Update a lot's cached rates after an edit, dropping deleted or inactive lots."""
+        if lot is None or not lot.get("is_active", True):
+            self._rates.pop(lot_id, None)
+        else:
+            self._rates[lot_id] = (lot["price_per_hour"], compiled_tariff(lot))
+
+    async def lot_rates(self, db, lot_ids: Iterable[str]) -> Dict[str, LotRates]:
+        """Rates of the given active lots, loading any not cached in one query."""
+        lot_ids = list(lot_ids)
+        missing = [lot_id for lot_id in lot_ids if lot_id not in self._rates]
+        if missing:
+            lots = await db.parking_lots.find(
+                {"_id": {"$in": [ObjectId(lot_id) for lot_id in missing]}, "is_active": True},
+                {"price_per_hour": 1, "tariffs": 1}
+            ).to_list(length=None)
+            for lot in lots:
+                self.set_rates(str(lot["_id"]), lot)
+        return {lot_id: self._rates[lot_id] for lot_id in lot_ids if lot_id in self._rates}
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        logger.info("Surge pricing engine started")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh(get_database())
+            except Exception as err:
+                logger.error(f"Surge multiplier refresh failed: {err}")
+            await asyncio.sleep(settings.surge_refresh_seconds)
+
+
+surge_pricing = SurgePricingEngine()
@@ -0,0 +1,113 @@
+"""
+Size-bounded disk cache for rendered receipt PDFs.
+
+Receipts are keyed by booking ID plus the booking's `updated_at`, so any
+edit to a booking naturally misses the cache and older versions are
+dropped when the new one is stored. Least recently used files are
+evicted once the directory grows past `receipt_cache_max_bytes`. The
+in-memory index is rebuilt from the directory on first use, ordered by
+file access time, and files written by other workers are adopted on
+lookup.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def receipt_cache_key(booking_id: str, updated_at: datetime) -> str:
+    """Cache key (and ETag value) for one version of a booking's receipt."""
+    return f"{booking_id}-{int(updated_at.timestamp() * 1_000_000)}"
+
+
+class ReceiptCache:
+    """LRU cache of receipt PDFs stored as files in one directory."""
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size in bytes
+        self._total_bytes = 0
+        self._loaded = False
+        # Called from worker threads; guards the index, not the files
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(settings.receipt_cache_dir, f"{key}.pdf")
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        os.makedirs(settings.receipt_cache_dir, exist_ok=True)
+        files = []
+        with os.scandir(settings.receipt_cache_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".pdf"):
+                    stat = entry.stat()
+                    files.append((stat.st_atime, entry.name[:-len(".pdf")], stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._loaded = True
+
+    def _forget(self, key: str) -> None:
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._total_bytes -= size
+
+    def _delete(self, key: str) -> None:
+        self._forget(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def get_path(self, key: str) -> Optional[str]:
+        """Return the file holding `key`, marking it recently used, or None."""
+        with self._lock:
+            self._ensure_loaded()
+            path = self._path(key)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Evicted by another worker
+                self._forget(key)
+                return None
+
+            if key not in self._entries:
+                self._entries[key] = stat.st_size
+                self._total_bytes += stat.st_size
+            self._entries.move_to_end(key)
+            # Persist recency so a restart rebuilds the same LRU order
+            os.utime(path)
+            return path
+
+    def put(self, booking_id: str, key: str, data: bytes) -> None:
+        """Store a receipt, dropping the booking's older versions and evicting as needed."""
+        with self._lock:
+            self._ensure_loaded()
+            for stale in [k for k in self._entries if k.startswith(f"{booking_id}-") and k != key]:
+                self._delete(stale)
+
+            # Write then rename so readers never see a partial file
+            path = self._path(key)
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as handle:
+                handle.write(data)
+            os.replace(temp_path, path)
+
+            self._forget(key)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+
+            while self._total_bytes > settings.receipt_cache_max_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                self._delete(oldest)
+                logger.debug(f"Evicted receipt {oldest} from cache")
+
+
+receipt_cache = ReceiptCache()
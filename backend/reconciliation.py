@@ -0,0 +1,146 @@
+"""
+Reconciliation of the per-lot slot counters.
+
+`parking_lots.total_slots` and `available_slots` are kept up to date with
+`$inc` calls wherever slots are claimed, released, added or removed, and
+can drift when a request dies halfway or data is loaded out of band.
+Reconciling recounts the slots of every lot (or only the given ones) with
+a single grouped aggregation and writes back just the differences in one
+`bulk_write`. The next run picks up whatever a run skips.
+
+Claiming or releasing a slot and adjusting its lot's counter are two
+separate writes, and in between the counter legitimately disagrees with
+the slots. Lots whose slots or counters changed within the last
+`reconcile_grace_seconds` are therefore skipped, and each correction
+only applies if the lot still holds the counts that were read. A request
+stalled for longer than the grace period between those two writes can
+still be miscounted; the run after it completes corrects that.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from config import settings
+from database import get_database
+from models import SlotStatus
+
+logger = logging.getLogger(__name__)
+
+
+async def _count_slots(db, lot_ids: Optional[List[str]]) -> Dict[str, dict]:
+    """Actual slot counts per lot ID."""
+    pipeline = []
+    if lot_ids is not None:
+        pipeline.append({"$match": {"lot_id": {"$in": lot_ids}}})
+    pipeline.append({
+        "$group": {
+            "_id": "$lot_id",
+            "total_slots": {"$sum": 1},
+            "available_slots": {
+                "$sum": {"$cond": [{"$eq": ["$status", SlotStatus.AVAILABLE.value]}, 1, 0]}
+            },
+            "updated_at": {"$max": "$updated_at"}
+        }
+    })
+    counts = await db.parking_slots.aggregate(pipeline).to_list(length=None)
+    return {row["_id"]: row for row in counts}
+
+
+async def reconcile_slot_counters(db, lot_ids: Optional[List[str]] = None) -> dict:
+    """
+    Bring lot counters in line with their slots.
+
+    Returns how many lots were checked, how many were skipped as recently
+    changed, and the corrections applied, each with the stored and
+    actual counts.
+    """
+    lot_query = {}
+    if lot_ids is not None:
+        lot_query["_id"] = {"$in": [ObjectId(lot_id) for lot_id in lot_ids]}
+
+    lots = await db.parking_lots.find(
+        lot_query,
+        {"total_slots": 1, "available_slots": 1, "updated_at": 1}
+    ).to_list(length=None)
+    counts = await _count_slots(db, [str(lot["_id"]) for lot in lots] if lot_ids is not None else None)
+
+    now = datetime.utcnow()
+    settled_before = now - timedelta(seconds=settings.reconcile_grace_seconds)
+    corrections = []
+    writes = []
+    skipped = 0
+    for lot in lots:
+        lot_id = str(lot["_id"])
+        actual = counts.get(lot_id, {"total_slots": 0, "available_slots": 0})
+        # A booking may sit between its slot claim and its counter update
+        changed = [lot.get("updated_at"), actual.get("updated_at")]
+        if any(moment and moment > settled_before for moment in changed):
+            skipped += 1
+            continue
+
+        stored = {
+            "total_slots": lot.get("total_slots", 0),
+            "available_slots": lot.get("available_slots", 0)
+        }
+        deltas = {
+            field: actual[field] - stored[field]
+            for field in stored
+            if actual[field] != stored[field]
+        }
+        if not deltas:
+            continue
+
+        corrections.append({
+            "lot_id": lot_id,
+            **{field: {"stored": stored[field], "actual": actual[field]} for field in deltas}
+        })
+        writes.append(UpdateOne(
+            {"_id": lot["_id"], **stored},
+            {"$inc": deltas, "$set": {"updated_at": now}}
+        ))
+
+    applied = 0
+    if writes:
+        result = await db.parking_lots.bulk_write(writes, ordered=False)
+        applied = result.modified_count
+        logger.info(f"Reconciled slot counters on {applied} of {len(writes)} drifted lots")
+
+    return {
+        "checked": len(lots),
+        "skipped_recent": skipped,
+        "drifted": len(writes),
+        "corrected": applied,
+        "corrections": corrections
+    }
+
+
+class SlotCounterReconciler:
+    """Runs the reconciliation over every lot on a fixed interval."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        logger.info("Slot counter reconciliation scheduled")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await reconcile_slot_counters(get_database())
+            except Exception as err:
+                logger.error(f"Slot counter reconciliation failed: {err}")
+            await asyncio.sleep(settings.reconcile_interval_seconds)
+
+
+slot_counter_reconciler = SlotCounterReconciler()
@@ -0,0 +1,100 @@
+"""
+Process-pool rendering service for CPU-bound QR code and PDF work.
+
+qrcode/PIL and reportlab hold the GIL for the whole render, so running
+them on the event loop (or a thread) stalls every other request on the
+worker. The service farms them out to a pool of spawned processes and
+exposes async wrappers. Booking QR images are rendered on demand from
+their signed payload and kept in a small in-memory LRU cache.
+"""
+import asyncio
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, Tuple
+
+from config import settings
+from models import BookingReceipt
+from utils import ReceiptPDFResult, build_receipt_pdf, generate_qr_code, render_qr_image
+
+logger = logging.getLogger(__name__)
+
+
+class RenderService:
+    """Owns the rendering process pool and runs render calls on it."""
+
+    def __init__(self):
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._qr_cache: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+        self._restart_lock = asyncio.Lock()
+
+    @staticmethod
+    def _new_executor() -> ProcessPoolExecutor:
+        # Spawn rather than fork so children don't inherit the event loop
+        # or open MongoDB sockets
+        return ProcessPoolExecutor(
+            max_workers=settings.render_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def start(self) -> None:
+        self._executor = self._new_executor()
+        logger.info(f"Render service started with {settings.render_workers} processes")
+
+    def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+            logger.info("Render service stopped")
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        if self._executor is None:
+            # Not started (scripts, one-off tools): keep the loop responsive
+            return await asyncio.to_thread(func, *args)
+
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            return await loop.run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            # A crashed child poisons the whole pool; replace it and retry once
+            await self._replace_broken(executor)
+            return await loop.run_in_executor(self._executor, func, *args)
+
+    async def _replace_broken(self, broken: ProcessPoolExecutor) -> None:
+        """Swap in a fresh pool unless another caller already replaced `broken`."""
+        async with self._restart_lock:
+            if self._executor is not broken:
+                return
+            logger.error("Render process pool broke, restarting it")
+            self._executor = self._new_executor()
+        # The broken pool's futures have already failed; don't block the
+        # loop waiting for its dead workers to be reaped
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    async def qr_code(self, data: str) -> str:
+        """Render a QR code as a base64 PNG data URL."""
+        return await self._run(generate_qr_code, data)
+
+    async def qr_image(self, data: str, image_format: str = "png") -> bytes:
+        """Render a QR code as PNG or SVG bytes, serving repeats from the cache."""
+        key = (data, image_format)
+        image = self._qr_cache.get(key)
+        if image is not None:
+            self._qr_cache.move_to_end(key)
+            return image
+
+        image = await self._run(render_qr_image, data, image_format)
+        self._qr_cache[key] = image
+        while len(self._qr_cache) > settings.qr_cache_size:
+            self._qr_cache.popitem(last=False)
+        return image
+
+    async def receipt_pdf(self, receipt: BookingReceipt) -> ReceiptPDFResult:
+        """Render a booking receipt PDF."""
+        return await self._run(build_receipt_pdf, receipt)
+
+
+render_service = RenderService()
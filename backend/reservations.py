@@ -0,0 +1,169 @@
+"""
+Atomic slot reservations stored on parking_slots documents.
+
+Every live booking is mirrored as an entry in its slot's `reservations`
+array. Claiming a window is a single conditional update that only
+matches when no entry overlaps it, so two concurrent requests can never
+both win the same slot and time. Entries whose window has passed are
+pruned whenever the array is rewritten. Bookings made before slots
+carried this array are copied in by the `backfill_slot_reservations`
+migration.
+"""
+from datetime import datetime
+from typing import Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from models import SlotStatus
+from utils import to_naive_utc
+
+
+def _overlapping(start: datetime, end: datetime, exclude_booking_id: Optional[str] = None) -> dict:
+    """Filter matching reservation entries that intersect [start, end)."""
+    condition = {"start_time": {"$lt": end}, "end_time": {"$gt": start}}
+    if exclude_booking_id:
+        condition["booking_id"] = {"$ne": exclude_booking_id}
+    return {"$elemMatch": condition}
+
+
+def _kept_reservations(now: datetime, drop_booking_id: Optional[str] = None) -> dict:
+    """Expression for the reservations array minus expired and dropped entries."""
+    condition = {"$gt": ["$$this.end_time", now]}
+    if drop_booking_id:
+        condition = {"$and": [condition, {"$ne": ["$$this.booking_id", drop_booking_id]}]}
+    return {
+        "$filter": {
+            "input": {"$ifNull": ["$reservations", []]},
+            "cond": condition
+        }
+    }
+
+
+def claim_filter(slot_id: str, lot_id: str, start: datetime, end: datetime) -> dict:
+    """Match the slot only if it can take a booking for [start, end)."""
+    return {
+        "_id": ObjectId(slot_id),
+        "lot_id": lot_id,
+        "status": {"$ne": SlotStatus.MAINTENANCE},
+        "reservations": {"$not": _overlapping(to_naive_utc(start), to_naive_utc(end))}
+    }
+
+
+def claim_update(booking_id: str, start: datetime, end: datetime, now: datetime) -> list:
+    """Pipeline update appending a reservation and marking a free slot reserved."""
+    reservation = {
+        "booking_id": booking_id,
+        "start_time": to_naive_utc(start),
+        "end_time": to_naive_utc(end)
+    }
+    return [{
+        "$set": {
+            "reservations": {"$concatArrays": [_kept_reservations(now), [reservation]]},
+            "status": {
+                "$cond": [
+                    {"$eq": ["$status", SlotStatus.AVAILABLE.value]},
+                    SlotStatus.RESERVED.value,
+                    "$status"
+                ]
+            },
+            "updated_at": now
+        }
+    }]
+
+
+async def claim_slot(
+    db,
+    slot_id: str,
+    lot_id: str,
+    booking_id: str,
+    start: datetime,
+    end: datetime
+) -> Optional[dict]:
+    """
+    Atomically reserve a slot for a window.
+
+    Returns the slot document as it was before the claim, or None when the
+    slot is missing, in another lot, under maintenance or already taken.
+    """
+    return await db.parking_slots.find_one_and_update(
+        claim_filter(slot_id, lot_id, start, end),
+        claim_update(booking_id, start, end, datetime.utcnow()),
+        return_document=ReturnDocument.BEFORE
+    )
+
+
+async def extend_reservation(
+    db,
+    slot_id: str,
+    booking_id: str,
+    start: datetime,
+    old_end: datetime,
+    new_end: datetime
+) -> bool:
+    """Move a reservation's end time if the slot is free for the added tail."""
+    now = datetime.utcnow()
+    new_end = to_naive_utc(new_end)
+    query = {"_id": ObjectId(slot_id)}
+    if new_end > old_end:
+        query["reservations"] = {"$not": _overlapping(old_end, new_end, booking_id)}
+
+    reservation = {"booking_id": booking_id, "start_time": start, "end_time": new_end}
+    result = await db.parking_slots.update_one(query, [{
+        "$set": {
+            "reservations": {
+                "$concatArrays": [_kept_reservations(now, booking_id), [reservation]]
+            },
+            "updated_at": now
+        }
+    }])
+    return result.matched_count > 0
+
+
+def release_update(booking_id: str, now: datetime) -> list:
+    """Pipeline update dropping a reservation and freeing the slot if it was the last."""
+    kept = _kept_reservations(now, booking_id)
+    return [{
+        "$set": {
+            "status": {
+                "$cond": [
+                    {
+                        "$and": [
+                            {"$eq": ["$status", SlotStatus.RESERVED.value]},
+                            {"$eq": [{"$size": kept}, 0]}
+                        ]
+                    },
+                    SlotStatus.AVAILABLE.value,
+                    "$status"
+                ]
+            },
+            "reservations": kept,
+            "updated_at": now
+        }
+    }]
+
+
+def slot_freed_by_release(slot_before: Optional[dict], booking_id: str, now: datetime) -> bool:
+    """Tell from the pre-release slot document whether the release freed it."""
+    if not slot_before or slot_before.get("status") != SlotStatus.RESERVED:
+        return False
+    return not any(
+        reservation["booking_id"] != booking_id and reservation["end_time"] > now
+        for reservation in slot_before.get("reservations", [])
+    )
+
+
+async def release_slot(db, slot_id: str, booking_id: str) -> bool:
+    """
+    Drop a booking's reservation from its slot.
+
+    Returns True when this left the slot with no live reservations and
+    moved it back to available, so the caller can bump the lot counter.
+    """
+    now = datetime.utcnow()
+    slot_before = await db.parking_slots.find_one_and_update(
+        {"_id": ObjectId(slot_id)},
+        release_update(booking_id, now),
+        return_document=ReturnDocument.BEFORE
+    )
+    return slot_freed_by_release(slot_before, booking_id, now)
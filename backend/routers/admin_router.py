@@ -1,13 +1,18 @@
 """
 Admin-specific routes for user management, slot management, and real-time statistics.
 """
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from typing import List, Optional
+from asyncio import gather
 from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query
 from bson import ObjectId
+from bson.errors import InvalidId
 
-from auth import get_current_admin
+from auth import get_current_admin, password_hasher, token_cache
 from database import get_database
+from loaders import Loaders, get_loaders
+from reconciliation import reconcile_slot_counters
 from models import TokenData, UserRole, UserCreate, UserUpdate, ParkingSlotCreate, ParkingSlotUpdate
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
@@ -129,8 +134,6 @@ async def create_user_by_admin(
     current_user: TokenData = Depends(get_current_admin)
 ):
     """Create a new user (admin only)."""
-    from auth import get_password_hash
-    
     db = get_database()
     
     # Check if user already exists
@@ -143,7 +146,7 @@ async def create_user_by_admin(
         "email": user_data.email,
         "full_name": user_data.full_name,
         "phone": user_data.phone,
-        "password": get_password_hash(user_data.password),
+        "password": await password_hasher.hash(user_data.password),
         "role": user_data.role or "user",
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
@@ -168,8 +171,6 @@ async def update_user_by_admin(
     current_user: TokenData = Depends(get_current_admin)
 ):
     """Update user information (admin only)."""
-    from auth import get_password_hash
-    
     db = get_database()
     
     # Check if user exists
@@ -187,7 +188,7 @@ async def update_user_by_admin(
     if user_data.role is not None:
         update_doc["role"] = user_data.role
     if user_data.password is not None:
-        update_doc["password"] = get_password_hash(user_data.password)
+        update_doc["password"] = await password_hasher.hash(user_data.password)
     
     # Update user
     await db.users.update_one(
@@ -236,6 +237,8 @@ async def delete_user(
     
     # Delete user
     await db.users.delete_one({"_id": ObjectId(user_id)})
+    # Only frees memory; the user's token stays valid until it expires
+    token_cache.evict_user(user_id)
     
     return {"message": "User deleted successfully"}
 
@@ -444,11 +447,43 @@ async def delete_parking_slot(
     return {"message": "Parking slot deleted successfully"}
 
 
+# ==================== COUNTER RECONCILIATION ====================
+
+@router.post("/reconcile/slot-counters")
+async def reconcile_all_slot_counters(
+    current_user: TokenData = Depends(get_current_admin)
+):
+    """Recount slots for every lot and fix drifted counters."""
+    db = get_database()
+    return await reconcile_slot_counters(db)
+
+
+@router.post("/parking-lots/{lot_id}/reconcile")
+async def reconcile_lot_slot_counters(
+    lot_id: str,
+    current_user: TokenData = Depends(get_current_admin)
+):
+    """Recount one lot's slots and fix its counters if they drifted."""
+    db = get_database()
+    
+    try:
+        lot_oid = ObjectId(lot_id)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid lot ID")
+    
+    lot = await db.parking_lots.find_one({"_id": lot_oid}, {"_id": 1})
+    if not lot:
+        raise HTTPException(status_code=404, detail="Parking lot not found")
+    
+    return await reconcile_slot_counters(db, [lot_id])
+
+
 # ==================== REAL-TIME STATISTICS ====================
 
 @router.get("/stats/realtime")
 async def get_realtime_stats(
-    current_user: TokenData = Depends(get_current_admin)
+    current_user: TokenData = Depends(get_current_admin),
+    loaders: Loaders = Depends(get_loaders)
 ):
     """Get real-time statistics for admin dashboard."""
     db = get_database()
@@ -507,11 +542,13 @@ async def get_realtime_stats(
     # Recent activities (last 10 bookings)
     recent_bookings = await db.bookings.find().sort("created_at", -1).limit(10).to_list(length=10)
     
+    users, lots = await gather(
+        loaders.users.load_many(booking["user_id"] for booking in recent_bookings),
+        loaders.lots.load_many(booking["lot_id"] for booking in recent_bookings)
+    )
+    
     activities = []
-    for booking in recent_bookings:
-        user = await db.users.find_one({"_id": ObjectId(booking["user_id"])})
-        lot = await db.parking_lots.find_one({"_id": ObjectId(booking["lot_id"])})
-        
+    for booking, user, lot in zip(recent_bookings, users, lots):
         activities.append({
             "id": str(booking["_id"]),
             "user_name": user["full_name"] if user else "Unknown",
@@ -551,6 +588,14 @@ async def get_realtime_stats(
     }
 
 
+@router.get("/stats/token-cache")
+async def get_token_cache_stats(
+    current_user: TokenData = Depends(get_current_admin)
+):
+    """Hit rate and size of this worker's verified-token cache."""
+    return token_cache.stats()
+
+
 @router.get("/stats/analytics")
 async def get_analytics(
     range: str = Query("7d", regex="^(7d|30d|1y)$"),
@@ -7,6 +7,7 @@ from datetime import datetime, timedelta
 from database import get_database
 from models import DashboardStats, BookingAnalytics
 from auth import get_current_user, get_current_admin
+from loaders import Loaders, get_loaders
 import logging
 
 logger = logging.getLogger(__name__)
@@ -124,7 +125,10 @@ async def get_booking_analytics(
 
 
 @router.get("/user-stats")
-async def get_user_stats(current_user = Depends(get_current_user)):
+async def get_user_stats(
+    current_user = Depends(get_current_user),
+    loaders: Loaders = Depends(get_loaders)
+):
     """Get statistics for the current user."""
     db = get_database()
     
@@ -180,8 +184,7 @@ async def get_user_stats(current_user = Depends(get_current_user)):
     
     favorite_lot = None
     if favorite_lot_id:
-        from bson import ObjectId
-        lot = await db.parking_lots.find_one({"_id": ObjectId(favorite_lot_id)})
+        lot = await loaders.lots.load(favorite_lot_id)
         if lot:
             favorite_lot = {
                 "id": str(lot["_id"]),
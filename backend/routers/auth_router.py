@@ -7,8 +7,7 @@ from bson import ObjectId
 from database import get_database
 from models import UserCreate, UserLogin, UserResponse, Token, UserUpdate, UserRole
 from auth import (
-    get_password_hash,
-    verify_password,
+    password_hasher,
     create_access_token,
     get_current_user
 )
@@ -33,7 +32,7 @@ async def register(user_data: UserCreate):
         )
     
     # Hash password
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await password_hasher.hash(user_data.password)
     
     # Create user document
     user_doc = {
@@ -75,12 +74,16 @@ async def login(credentials: UserLogin):
         )
     
     # Verify password
-    if not verify_password(credentials.password, user["password"]):
+    if not await password_hasher.verify(credentials.password, user["password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password"
         )
     
+    # Bring hashes made at an older cost up to date, off the request path
+    if password_hasher.needs_rehash(user["password"]):
+        password_hasher.rehash_in_background(db, str(user["_id"]), credentials.password, user["password"])
+    
     # Create access token
     access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
     access_token = create_access_token(
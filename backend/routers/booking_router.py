@@ -1,15 +1,20 @@
 """
 Booking management routes with QR code generation and email notifications.
 """
-from asyncio import gather
+import base64
+import json
+from asyncio import gather, to_thread
+from collections import Counter
 
-from fastapi import APIRouter, HTTPException, status, Depends, Query
-from typing import List, Optional
+from fastapi import APIRouter, HTTPException, status, Depends, Header, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from typing import AsyncIterator, Dict, FrozenSet, List, Optional, Tuple
 from bson import ObjectId
 from datetime import datetime
 import logging
 
-from pymongo import ReturnDocument
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 from database import get_database
 from models import (
     BookingCreate,
@@ -17,24 +22,74 @@ from models import (
     BookingUpdate,
     BookingWithDetails,
     BookingStatus,
+    BulkBookingCreate,
+    BulkBookingItemResult,
+    BulkBookingResponse,
     PaymentStatus,
     SlotStatus,
-    ParkingLotResponse,
     VehicleResponse,
     BookingReceipt,
     ReceiptSlotInfo,
     ReceiptVehicleInfo
 )
 from auth import get_current_user, get_current_admin
+from config import settings
+from fieldsets import parse_fields, projection, sparse_response, trimmed_model
+from idempotency import IDEMPOTENCY_HEADER, run_idempotent
+from jobs import job_queue
+from lifecycle import lifecycle_scheduler
+from loaders import Loaders, get_loaders
+from pricing import surge_pricing
+from booking_index import booking_index, LIVE_BOOKING_STATUSES
+from reservations import claim_slot, extend_reservation, release_slot
+from rendering import render_service
+from receipt_cache import receipt_cache, receipt_cache_key
+from tariffs import compiled_tariff
 from utils import (
-    generate_qr_code,
     send_booking_confirmation_email,
     calculate_parking_price,
-    build_receipt_pdf,
     ReceiptPDFResult,
-    build_receipt_payload
+    build_receipt_payload,
+    lot_response,
+    sign_qr_payload,
+    to_naive_utc
 )
 
+QR_MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+STREAM_BATCH_SIZE = 200
+
+# Booking document fields copied as-is into responses
+BOOKING_DOCUMENT_FIELDS = (
+    "user_id", "lot_id", "slot_id", "vehicle_id", "start_time", "end_time",
+    "status", "total_price", "payment_status", "created_at", "updated_at"
+)
+# Document fields each computed response field is built from; the
+# keyset cursor always needs created_at
+BOOKING_FIELD_SOURCES = {
+    "id": ["created_at"],
+    "qr_code": ["qr_payload"],
+    "parking_lot": ["lot_id"],
+    "vehicle": ["vehicle_id"],
+    "receipt": [
+        "user_id", "lot_id", "slot_id", "vehicle_id", "start_time", "end_time",
+        "status", "payment_status", "total_price", "created_at", "qr_payload", "receipt"
+    ],
+}
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """Check an If-None-Match header against a strong ETag."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def _qr_payload(booking: dict) -> str:
+    """Signed QR payload of a booking; older bookings get theirs derived."""
+    return booking.get("qr_payload") or sign_qr_payload(str(booking["_id"]))
+
 
 async def _maybe_build_receipt(
     *,
@@ -61,87 +116,161 @@ async def _maybe_build_receipt(
             payment_status=booking.get("payment_status", PaymentStatus.PENDING),
             total_price=booking["total_price"],
             created_at=booking.get("created_at", datetime.utcnow()),
-            qr_code=booking.get("qr_code")
+            qr_code=_qr_payload(booking)
         )
     except Exception as err:
         logger.error(f"Failed to build booking receipt payload: {err}")
         return booking.get("receipt")
 
+
+def _slot_problem(slot: Optional[dict], lot_id: str) -> Optional[HTTPException]:
+    """Explain why a slot can't take a booking in `lot_id`, if it can't at all."""
+    if not slot:
+        return HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Parking slot not found"
+        )
+    if slot["lot_id"] != lot_id:
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Parking slot does not belong to this lot"
+        )
+    if slot["status"] == SlotStatus.MAINTENANCE:
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Parking slot is under maintenance"
+        )
+    return None
+
+
+async def _raise_claim_failure(db, slot_oid: ObjectId, lot_id: str) -> None:
+    """Explain why a slot claim matched nothing; only runs on the failure path."""
+    slot = await db.parking_slots.find_one({"_id": slot_oid}, {"lot_id": 1, "status": 1})
+    problem = _slot_problem(slot, lot_id)
+    if problem:
+        raise problem
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Parking slot is already booked for this time"
+    )
+
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/bookings", tags=["Bookings"])
 
 
+async def _slot_is_free(db, lot_id: str, slot_id: str, start: datetime, end: datetime) -> bool:
+    """
+    Check the booking index for a conflict in [start, end).
+    
+    The index is per worker and refreshed periodically, so a conflict it
+    reports is confirmed against a freshly loaded schedule; the booking
+    may have been cancelled through another worker since.
+    """
+    if booking_index.is_free(slot_id, start, end):
+        return True
+    await booking_index.ensure_slot_loaded(db, lot_id, slot_id, force=True)
+    return booking_index.is_free(slot_id, start, end)
+
+
 @router.post("", response_model=BookingResponse, status_code=status.HTTP_201_CREATED)
 async def create_booking(
     booking_data: BookingCreate,
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER)
 ):
-    """Create a new parking booking."""
+    """Create a new parking booking. Retries carrying the same Idempotency-Key get the original response."""
+    return await run_idempotent(
+        idempotency_key,
+        f"{current_user.user_id}:create_booking",
+        booking_data,
+        status.HTTP_201_CREATED,
+        lambda: _create_booking(booking_data, current_user)
+    )
+
+
+async def _create_booking(booking_data: BookingCreate, current_user) -> BookingResponse:
     db = get_database()
     
-    # Verify parking lot exists
     try:
-        lot = await db.parking_lots.find_one({"_id": ObjectId(booking_data.lot_id)})
+        lot_oid = ObjectId(booking_data.lot_id)
+        slot_oid = ObjectId(booking_data.slot_id)
+        vehicle_oid = ObjectId(booking_data.vehicle_id)
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid lot ID"
+            detail="Invalid lot, slot or vehicle ID"
         )
     
+    # Validate lot and vehicle, fetch the user for the receipt and warm the
+    # slot's schedule concurrently
+    lot, vehicle, user, _ = await gather(
+        db.parking_lots.find_one({"_id": lot_oid}),
+        db.vehicles.find_one({"_id": vehicle_oid, "user_id": current_user.user_id}),
+        db.users.find_one({"_id": ObjectId(current_user.user_id)}),
+        booking_index.ensure_slot_loaded(db, booking_data.lot_id, booking_data.slot_id),
+    )
+    
     if not lot:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Parking lot not found"
         )
     
-    # Verify slot exists and is available
-    try:
-        slot = await db.parking_slots.find_one({"_id": ObjectId(booking_data.slot_id)})
-    except Exception:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid slot ID"
-        )
-    
-    if not slot:
+    if not vehicle:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Parking slot not found"
-        )
-    
-    if slot["status"] != SlotStatus.AVAILABLE:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Parking slot is not available"
+            detail="Vehicle not found"
         )
     
-    # Verify vehicle exists and belongs to user
-    try:
-        vehicle = await db.vehicles.find_one({
-            "_id": ObjectId(booking_data.vehicle_id),
-            "user_id": current_user.user_id
-        })
-    except Exception:
+    if not user:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid vehicle ID"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
         )
     
-    if not vehicle:
+    # A slot can hold many bookings per day as long as they don't overlap.
+    # The index rejects known conflicts; the claim below is what actually
+    # guards against concurrent requests.
+    if not await _slot_is_free(
+        db,
+        booking_data.lot_id,
+        booking_data.slot_id,
+        booking_data.start_time,
+        booking_data.end_time
+    ):
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Vehicle not found"
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Parking slot is already booked for this time"
         )
     
-    # Calculate total price
+    # Calculate total price at the lot's current surge
+    multiplier = surge_pricing.multiplier(booking_data.lot_id)
     total_price = calculate_parking_price(
         lot["price_per_hour"],
         booking_data.start_time,
+        booking_data.end_time,
+        multiplier,
+        compiled_tariff(lot)
+    )
+    
+    booking_oid = ObjectId()
+    booking_id = str(booking_oid)
+    qr_payload = sign_qr_payload(booking_id)
+    
+    slot = await claim_slot(
+        db,
+        booking_data.slot_id,
+        booking_data.lot_id,
+        booking_id,
+        booking_data.start_time,
         booking_data.end_time
     )
+    if not slot:
+        await _raise_claim_failure(db, slot_oid, booking_data.lot_id)
     
     # Create booking document
     booking_doc = {
+        "_id": booking_oid,
         "user_id": current_user.user_id,
         "lot_id": booking_data.lot_id,
         "slot_id": booking_data.slot_id,
@@ -150,43 +279,46 @@ async def create_booking(
         "end_time": booking_data.end_time,
         "status": BookingStatus.PENDING,
         "total_price": total_price,
+        "surge_multiplier": multiplier,
         "payment_status": PaymentStatus.PENDING,
+        "qr_payload": qr_payload,
         "created_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
     }
     
-    result = await db.bookings.insert_one(booking_doc)
-    booking_id = str(result.inserted_id)
-    
-    # Generate QR code
-    qr_data = f"BOOKING:{booking_id}:{current_user.user_id}"
-    qr_code = generate_qr_code(qr_data)
-    
-    # Update booking with QR code
-    await db.bookings.update_one(
-        {"_id": ObjectId(booking_id)},
-        {"$set": {"qr_code": qr_code}}
-    )
-    
-    # Update slot status to reserved
-    await db.parking_slots.update_one(
-        {"_id": ObjectId(booking_data.slot_id)},
-        {"$set": {"status": SlotStatus.RESERVED, "updated_at": datetime.utcnow()}}
-    )
+    # Only a slot's first live booking takes it out of the lot's available count
+    writes = [db.bookings.insert_one(booking_doc)]
+    if slot["status"] == SlotStatus.AVAILABLE:
+        writes.append(db.parking_lots.update_one(
+            {"_id": lot_oid},
+            {"$inc": {"available_slots": -1}, "$set": {"updated_at": datetime.utcnow()}}
+        ))
+    inserted, *decremented = await gather(*writes, return_exceptions=True)
+    failures = [result for result in (inserted, *decremented) if isinstance(result, Exception)]
+    if failures:
+        # Undo only the writes that landed, then give the slot back
+        if not isinstance(inserted, Exception):
+            await db.bookings.delete_one({"_id": booking_oid})
+        # Freeing the slot returns it to the count, unless the decrement
+        # that took it out never applied
+        lot_restore = 1 if await release_slot(db, booking_data.slot_id, booking_id) else 0
+        if decremented and isinstance(decremented[0], Exception):
+            lot_restore -= 1
+        if lot_restore:
+            await db.parking_lots.update_one(
+                {"_id": lot_oid},
+                {"$inc": {"available_slots": lot_restore}}
+            )
+        raise failures[0]
     
-    # Update available slots count
-    await db.parking_lots.update_one(
-        {"_id": ObjectId(booking_data.lot_id)},
-        {"$inc": {"available_slots": -1}, "$set": {"updated_at": datetime.utcnow()}}
+    booking_index.add(
+        booking_data.lot_id,
+        booking_data.slot_id,
+        booking_id,
+        booking_data.start_time,
+        booking_data.end_time
     )
-    
-    # Get user info for email
-    user = await db.users.find_one({"_id": ObjectId(current_user.user_id)})
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="User not found"
-        )
+    lifecycle_scheduler.track(booking_doc)
     
     receipt_payload: Optional[BookingReceipt] = None
     try:
@@ -202,35 +334,17 @@ async def create_booking(
             payment_status=PaymentStatus.PENDING,
             total_price=total_price,
             created_at=booking_doc["created_at"],
-            qr_code=qr_code
+            qr_code=qr_payload
         )
     except Exception as e:
         logger.error(f"Failed to build receipt payload: {e}")
         receipt_payload = None
     
-    pdf_receipt: Optional[ReceiptPDFResult] = None
-    if receipt_payload:
-        try:
-            pdf_receipt = build_receipt_pdf(receipt_payload)
-        except Exception as err:
-            logger.error(f"Failed to generate receipt PDF: {err}")
-
-    # Send confirmation email (async, don't wait)
+    # PDF receipt and email are produced off the request path
     try:
-        await send_booking_confirmation_email(
-            to_email=user["email"],
-            user_name=user.get("full_name", ""),
-            booking_id=booking_id,
-            parking_lot_name=lot.get("name", ""),
-            start_time=booking_data.start_time.strftime("%Y-%m-%d %H:%M"),
-            end_time=booking_data.end_time.strftime("%Y-%m-%d %H:%M"),
-            total_price=total_price,
-            qr_code=qr_code,
-            receipt=receipt_payload,
-            pdf_receipt=pdf_receipt
-        )
+        await job_queue.enqueue("booking_confirmation", {"booking_id": booking_id})
     except Exception as e:
-        logger.error(f"Failed to send confirmation email: {e}")
+        logger.error(f"Failed to queue booking confirmation: {e}")
     
     logger.info(f"Booking created: {booking_id} by user {current_user.user_id}")
     
@@ -245,200 +359,657 @@ async def create_booking(
         status=BookingStatus.PENDING,
         total_price=total_price,
         payment_status=PaymentStatus.PENDING,
-        qr_code=qr_code,
+        qr_code=qr_payload,
         created_at=booking_doc["created_at"],
         updated_at=booking_doc["updated_at"],
         receipt=receipt_payload
     )
 
 
+@job_queue.handler("booking_confirmation")
+async def send_booking_confirmation(payload: dict) -> None:
+    """Render the booking QR code and PDF receipt, then email the customer."""
+    db = get_database()
+    booking_id = payload["booking_id"]
+    
+    booking = await db.bookings.find_one({"_id": ObjectId(booking_id)})
+    if not booking:
+        logger.warning(f"Booking {booking_id} disappeared before confirmation")
+        return
+    if booking.get("confirmation_sent_at"):
+        # Already confirmed by an earlier attempt of a batch job
+        return
+    
+    lot, slot, vehicle, user = await gather(
+        db.parking_lots.find_one({"_id": ObjectId(booking["lot_id"])}),
+        db.parking_slots.find_one({"_id": ObjectId(booking["slot_id"])}),
+        db.vehicles.find_one({"_id": ObjectId(booking["vehicle_id"])}),
+        db.users.find_one({"_id": ObjectId(booking["user_id"])}),
+    )
+    if not user:
+        logger.warning(f"User for booking {booking_id} not found, skipping confirmation")
+        return
+    
+    # The email embeds the image itself; the booking only keeps the payload
+    qr_code = await render_service.qr_code(_qr_payload(booking))
+    
+    receipt_payload = await _maybe_build_receipt(
+        booking=booking,
+        lot=lot,
+        slot=slot,
+        vehicle=vehicle,
+        user=user,
+    )
+    
+    pdf_receipt: Optional[ReceiptPDFResult] = None
+    if receipt_payload:
+        try:
+            pdf_receipt = await render_service.receipt_pdf(receipt_payload)
+        except Exception as err:
+            logger.error(f"Failed to generate receipt PDF: {err}")
+    
+    sent = await send_booking_confirmation_email(
+        to_email=user["email"],
+        user_name=user.get("full_name", ""),
+        booking_id=booking_id,
+        parking_lot_name=(lot or {}).get("name", ""),
+        start_time=booking["start_time"].strftime("%Y-%m-%d %H:%M"),
+        end_time=booking["end_time"].strftime("%Y-%m-%d %H:%M"),
+        total_price=booking["total_price"],
+        qr_code=qr_code,
+        receipt=receipt_payload,
+        pdf_receipt=pdf_receipt
+    )
+    if sent:
+        await db.bookings.update_one(
+            {"_id": booking["_id"]},
+            {"$set": {"confirmation_sent_at": datetime.utcnow()}}
+        )
+    # Unconfigured SMTP is a deliberate skip; anything else is worth a retry
+    elif settings.smtp_user and settings.smtp_password:
+        raise RuntimeError(f"Confirmation email for booking {booking_id} was not sent")
+
+
+@job_queue.handler("booking_confirmation_batch")
+async def send_booking_confirmations(payload: dict) -> None:
+    """Confirm every booking of a bulk request; a retry skips those already sent."""
+    outcomes = await gather(
+        *(send_booking_confirmation({"booking_id": booking_id}) for booking_id in payload["booking_ids"]),
+        return_exceptions=True
+    )
+    failed = [
+        booking_id
+        for booking_id, outcome in zip(payload["booking_ids"], outcomes)
+        if isinstance(outcome, Exception)
+    ]
+    if failed:
+        raise RuntimeError(f"Confirmation failed for bookings: {', '.join(failed)}")
+
+
+@router.post("/bulk", response_model=BulkBookingResponse)
+async def create_bookings_bulk(
+    bulk_data: BulkBookingCreate,
+    current_user = Depends(get_current_user),
+    loaders: Loaders = Depends(get_loaders)
+):
+    """
+    Create many bookings in one request, e.g. for a fleet of vehicles.
+    
+    Lots, slots and vehicles are validated with one query per collection
+    and the slots are claimed concurrently, one atomic update each. Items
+    succeed or fail independently, each with its own HTTP-style status code.
+    """
+    db = get_database()
+    items = bulk_data.bookings
+    results: Dict[int, BulkBookingItemResult] = {}
+    
+    def fail(index: int, status_code: int, detail: str) -> None:
+        results[index] = BulkBookingItemResult(index=index, status_code=status_code, error=detail)
+    
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            ObjectId(item.lot_id), ObjectId(item.slot_id), ObjectId(item.vehicle_id)
+        except Exception:
+            fail(index, status.HTTP_400_BAD_REQUEST, "Invalid lot, slot or vehicle ID")
+            continue
+        valid.append(index)
+    
+    lots, slots, vehicles, user, _ = await gather(
+        loaders.lots.load_many(items[index].lot_id for index in valid),
+        loaders.slots.load_many(items[index].slot_id for index in valid),
+        loaders.vehicles.load_many(items[index].vehicle_id for index in valid),
+        loaders.users.load(current_user.user_id),
+        booking_index.ensure_lots_loaded(db, {items[index].lot_id for index in valid}),
+    )
+    
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+    
+    # Reload the schedules of slots the index reports as taken before
+    # trusting it; another worker may have freed them since they were loaded
+    conflicted = {
+        items[index].slot_id: items[index].lot_id
+        for index in valid
+        if not booking_index.is_free(items[index].slot_id, items[index].start_time, items[index].end_time)
+    }
+    await gather(*(
+        booking_index.ensure_slot_loaded(db, lot_id, slot_id, force=True)
+        for slot_id, lot_id in conflicted.items()
+    ))
+    
+    # Windows taken by earlier items, so two items can't share a slot and time
+    accepted: Dict[str, List[Tuple[datetime, datetime]]] = {}
+    claims = []
+    for index, lot, slot, vehicle in zip(valid, lots, slots, vehicles):
+        item = items[index]
+        if not lot:
+            fail(index, status.HTTP_404_NOT_FOUND, "Parking lot not found")
+            continue
+        if not vehicle or vehicle["user_id"] != current_user.user_id:
+            fail(index, status.HTTP_404_NOT_FOUND, "Vehicle not found")
+            continue
+        problem = _slot_problem(slot, item.lot_id)
+        if problem:
+            fail(index, problem.status_code, problem.detail)
+            continue
+        
+        start, end = to_naive_utc(item.start_time), to_naive_utc(item.end_time)
+        taken = accepted.setdefault(item.slot_id, [])
+        if not booking_index.is_free(item.slot_id, start, end) or any(
+            taken_start < end and start < taken_end for taken_start, taken_end in taken
+        ):
+            fail(index, status.HTTP_409_CONFLICT, "Parking slot is already booked for this time")
+            continue
+        taken.append((start, end))
+        
+        multiplier = surge_pricing.multiplier(item.lot_id)
+        claims.append({
+            "index": index,
+            "item": item,
+            "slot": slot,
+            "booking_oid": ObjectId(),
+            "surge_multiplier": multiplier,
+            "total_price": calculate_parking_price(
+                lot["price_per_hour"],
+                item.start_time,
+                item.end_time,
+                multiplier,
+                compiled_tariff(lot)
+            )
+        })
+    
+    created = []
+    if claims:
+        # Each claim returns its slot as it was just before the claim, which
+        # tells whether this claim is the one that took the slot
+        slots_before = await gather(*(
+            claim_slot(
+                db,
+                claim["item"].slot_id,
+                claim["item"].lot_id,
+                str(claim["booking_oid"]),
+                claim["item"].start_time,
+                claim["item"].end_time
+            )
+            for claim in claims
+        ))
+        for claim, slot_before in zip(claims, slots_before):
+            if slot_before is not None:
+                claim["slot"] = slot_before
+                created.append(claim)
+            else:
+                fail(claim["index"], status.HTTP_409_CONFLICT, "Parking slot is already booked for this time")
+    
+    if created:
+        booking_docs = [
+            {
+                "_id": claim["booking_oid"],
+                "user_id": current_user.user_id,
+                "lot_id": claim["item"].lot_id,
+                "slot_id": claim["item"].slot_id,
+                "vehicle_id": claim["item"].vehicle_id,
+                "start_time": claim["item"].start_time,
+                "end_time": claim["item"].end_time,
+                "status": BookingStatus.PENDING,
+                "total_price": claim["total_price"],
+                "surge_multiplier": claim["surge_multiplier"],
+                "payment_status": PaymentStatus.PENDING,
+                "qr_payload": sign_qr_payload(str(claim["booking_oid"])),
+                "created_at": datetime.utcnow(),
+                "updated_at": datetime.utcnow()
+            }
+            for claim in created
+        ]
+        
+        # As in create_booking, only a slot's first live booking leaves the
+        # lot's available count; at most one claim per slot saw it available
+        taken_per_lot = Counter(
+            claim["item"].lot_id
+            for claim in created
+            if claim["slot"]["status"] == SlotStatus.AVAILABLE
+        )
+        
+        taken_lots = list(taken_per_lot.items())
+        writes = [db.bookings.insert_many(booking_docs, ordered=False)]
+        if taken_lots:
+            writes.append(db.parking_lots.bulk_write([
+                UpdateOne(
+                    {"_id": ObjectId(lot_id)},
+                    {"$inc": {"available_slots": -taken}, "$set": {"updated_at": datetime.utcnow()}}
+                )
+                for lot_id, taken in taken_lots
+            ], ordered=False))
+        results_or_errors = await gather(*writes, return_exceptions=True)
+        failures = [result for result in results_or_errors if isinstance(result, Exception)]
+        if failures:
+            logger.error(f"Failed to save bulk bookings: {failures[0]}")
+            await db.bookings.delete_many({"_id": {"$in": [doc["_id"] for doc in booking_docs]}})
+            
+            # Lots whose decrement applied; a BulkWriteError lists the ones
+            # that didn't, any other error leaves it unknown, so assume none did
+            decremented = {}
+            if taken_lots:
+                outcome = results_or_errors[1]
+                if not isinstance(outcome, Exception):
+                    decremented = dict(taken_lots)
+                elif isinstance(outcome, BulkWriteError):
+                    failed_ops = {error["index"] for error in outcome.details.get("writeErrors", [])}
+                    decremented = {
+                        lot_id: taken
+                        for op_index, (lot_id, taken) in enumerate(taken_lots)
+                        if op_index not in failed_ops
+                    }
+            
+            freed = await gather(*(
+                release_slot(db, claim["item"].slot_id, str(claim["booking_oid"]))
+                for claim in created
+            ))
+            # As in create_booking: a freed slot goes back into the count,
+            # less the decrements that never applied
+            lot_restore = Counter(
+                claim["item"].lot_id
+                for claim, slot_freed in zip(created, freed)
+                if slot_freed
+            )
+            for lot_id, taken in taken_lots:
+                lot_restore[lot_id] -= taken - decremented.get(lot_id, 0)
+            for lot_id, restore in lot_restore.items():
+                if restore:
+                    await db.parking_lots.update_one(
+                        {"_id": ObjectId(lot_id)},
+                        {"$inc": {"available_slots": restore}}
+                    )
+            for claim in created:
+                fail(claim["index"], status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to save booking")
+            created, booking_docs = [], []
+        
+        for claim, doc in zip(created, booking_docs):
+            booking_index.add(doc["lot_id"], doc["slot_id"], str(doc["_id"]), doc["start_time"], doc["end_time"])
+            lifecycle_scheduler.track(doc)
+            results[claim["index"]] = BulkBookingItemResult(
+                index=claim["index"],
+                status_code=status.HTTP_201_CREATED,
+                booking=BookingResponse(
+                    id=str(doc["_id"]),
+                    user_id=doc["user_id"],
+                    lot_id=doc["lot_id"],
+                    slot_id=doc["slot_id"],
+                    vehicle_id=doc["vehicle_id"],
+                    start_time=doc["start_time"],
+                    end_time=doc["end_time"],
+                    status=doc["status"],
+                    total_price=doc["total_price"],
+                    payment_status=doc["payment_status"],
+                    qr_code=doc["qr_payload"],
+                    created_at=doc["created_at"],
+                    updated_at=doc["updated_at"]
+                )
+            )
+        
+        if booking_docs:
+            try:
+                await job_queue.enqueue(
+                    "booking_confirmation_batch",
+                    {"booking_ids": [str(doc["_id"]) for doc in booking_docs]}
+                )
+            except Exception as e:
+                logger.error(f"Failed to queue bulk booking confirmation: {e}")
+    
+    logger.info(f"Bulk booking by user {current_user.user_id}: {len(created)} of {len(items)} created")
+    
+    return BulkBookingResponse(
+        created=len(created),
+        failed=len(items) - len(created),
+        results=[results[index] for index in range(len(items))]
+    )
+
+
+async def _detail_rows(
+    loaders: Loaders,
+    bookings: List[dict],
+    selected: Optional[FrozenSet[str]] = None
+) -> List[dict]:
+    """
+    Build BookingWithDetails fields for each booking, limited to `selected`.
+    
+    Related documents are fetched with one query per collection, and only
+    for the collections the selected fields need.
+    """
+    def wants(name: str) -> bool:
+        return selected is None or name in selected
+    
+    async def load_related(loader, key: str, needed: bool) -> List[Optional[dict]]:
+        if not needed:
+            return [None] * len(bookings)
+        return await loader.load_many(booking[key] for booking in bookings)
+    
+    needs_receipt = wants("receipt")
+    lots, slots, vehicles, users = await gather(
+        load_related(loaders.lots, "lot_id", needs_receipt or wants("parking_lot")),
+        load_related(loaders.slots, "slot_id", needs_receipt),
+        load_related(loaders.vehicles, "vehicle_id", needs_receipt or wants("vehicle")),
+        load_related(loaders.users, "user_id", needs_receipt),
+    )
+
+    rows = []
+    for booking, lot, slot, vehicle, user in zip(bookings, lots, slots, vehicles, users):
+        row = {"id": str(booking["_id"])}
+        for name in BOOKING_DOCUMENT_FIELDS:
+            if wants(name):
+                row[name] = booking[name]
+        if wants("qr_code"):
+            row["qr_code"] = _qr_payload(booking)
+
+        if wants("parking_lot"):
+            row["parking_lot"] = None
+            if lot:
+                row["parking_lot"] = lot_response(lot)
+
+        if wants("vehicle"):
+            row["vehicle"] = None
+            if vehicle:
+                row["vehicle"] = VehicleResponse(
+                    id=str(vehicle["_id"]),
+                    user_id=vehicle["user_id"],
+                    license_plate=vehicle["license_plate"],
+                    make=vehicle["make"],
+                    model=vehicle["model"],
+                    color=vehicle.get("color"),
+                    vehicle_type=vehicle["vehicle_type"],
+                    created_at=vehicle["created_at"]
+                )
+
+        if needs_receipt:
+            row["receipt"] = await _maybe_build_receipt(
+                booking=booking,
+                lot=lot,
+                slot=slot,
+                vehicle=vehicle,
+                user=user,
+            )
+
+        rows.append(row)
+
+    return rows
+
+
+async def _with_details(loaders: Loaders, bookings: List[dict]) -> List[BookingWithDetails]:
+    """Attach lot, vehicle and receipt details using one query per collection."""
+    return [BookingWithDetails(**row) for row in await _detail_rows(loaders, bookings)]
+
+
 @router.get("", response_model=List[BookingWithDetails])
 async def get_user_bookings(
     status: Optional[BookingStatus] = Query(None),
-    current_user = Depends(get_current_user)
+    fields: Optional[str] = Query(None, description="Comma-separated response fields"),
+    current_user = Depends(get_current_user),
+    loaders: Loaders = Depends(get_loaders)
 ):
     """Get all bookings for the current user."""
     db = get_database()
+    selected = parse_fields(fields, BookingWithDetails)
 
     query = {"user_id": current_user.user_id}
     if status:
         query["status"] = status
 
-    cursor = db.bookings.find(query).sort("created_at", -1)
+    cursor = db.bookings.find(
+        query,
+        projection(selected, BOOKING_FIELD_SOURCES) if selected else None
+    ).sort("created_at", -1)
     bookings = await cursor.to_list(length=None)
 
-    result = []
-    for booking in bookings:
-        lot_task = db.parking_lots.find_one({"_id": ObjectId(booking["lot_id"])});
-        slot_task = db.parking_slots.find_one({"_id": ObjectId(booking["slot_id"])});
-        vehicle_task = db.vehicles.find_one({"_id": ObjectId(booking["vehicle_id"])});
-        user_task = db.users.find_one({"_id": ObjectId(booking["user_id"])});
-
-        lot, slot, vehicle, user_doc = await gather(
-            lot_task,
-            slot_task,
-            vehicle_task,
-            user_task,
-        )
-
-        lot_response = None
-        if lot:
-            lot_response = ParkingLotResponse(
-                id=str(lot["_id"]),
-                name=lot["name"],
-                address=lot["address"],
-                latitude=lot["latitude"],
-                longitude=lot["longitude"],
-                total_slots=lot["total_slots"],
-                available_slots=lot.get("available_slots", 0),
-                price_per_hour=lot["price_per_hour"],
-                operating_hours=lot["operating_hours"],
-                amenities=lot.get("amenities", []),
-                image_url=lot.get("image_url"),
-                is_active=lot["is_active"],
-                rating=lot.get("rating"),
-                total_reviews=lot.get("total_reviews", 0),
-                created_at=lot["created_at"]
-            )
+    if selected:
+        rows = await _detail_rows(loaders, bookings, selected)
+        return sparse_response(BookingWithDetails, selected, rows)
+    return await _with_details(loaders, bookings)
 
-        vehicle_response = None
-        if vehicle:
-            vehicle_response = VehicleResponse(
-                id=str(vehicle["_id"]),
-                user_id=vehicle["user_id"],
-                license_plate=vehicle["license_plate"]
-,
-                make=vehicle["make"],
-                model=vehicle["model"],
-                color=vehicle.get("color"),
-                vehicle_type=vehicle["vehicle_type"],
-                created_at=vehicle["created_at"]
-            )
 
-        receipt_payload = await _maybe_build_receipt(
-            booking=booking,
-            lot=lot,
-            slot=slot,
-            vehicle=vehicle,
-            user=user_doc,
+def _encode_cursor(booking: dict) -> str:
+    """Opaque keyset cursor pointing just past `booking` in (created_at, _id) order."""
+    raw = f"{booking['created_at'].isoformat()}|{booking['_id']}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> dict:
+    """Turn a cursor back into a filter matching the bookings after it."""
+    try:
+        created_at, booking_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        created_at = datetime.fromisoformat(created_at)
+        booking_oid = ObjectId(booking_id)
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
         )
+    return {
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": booking_oid}}
+        ]
+    }
 
-        result.append(BookingWithDetails(
-            id=str(booking["_id"]),
-            user_id=booking["user_id"],
-            lot_id=booking["lot_id"],
-            slot_id=booking["slot_id"],
-            vehicle_id=booking["vehicle_id"],
-            start_time=booking["start_time"],
-            end_time=booking["end_time"],
-            status=booking["status"],
-            total_price=booking["total_price"],
-            payment_status=booking["payment_status"],
-            qr_code=booking.get("qr_code"),
-            created_at=booking["created_at"],
-            updated_at=booking["updated_at"],
-            parking_lot=lot_response,
-            vehicle=vehicle_response,
-            receipt=receipt_payload
-        ))
 
-    return result
+async def _stream_with_details(
+    db,
+    bookings_cursor,
+    selected: Optional[FrozenSet[str]] = None,
+    limit: Optional[int] = None
+) -> AsyncIterator[str]:
+    """
+    Yield bookings as NDJSON, resolving details one batch at a time.
+    
+    With `limit`, the cursor must yield up to `limit + 1` bookings; if the
+    extra one arrives, a final `{"next_cursor": ...}` line is emitted
+    instead of it.
+    """
+    model = trimmed_model(BookingWithDetails, selected) if selected else BookingWithDetails
+    
+    async def encode(batch: List[dict]) -> str:
+        # Fresh loaders per batch keep the lookup cache from growing with the stream
+        rows = await _detail_rows(Loaders(db), batch, selected)
+        return "".join(model(**row).model_dump_json() + "\n" for row in rows)
+    
+    batch = []
+    streamed = 0
+    last = None
+    async for booking in bookings_cursor:
+        if limit is not None and streamed == limit:
+            if batch:
+                yield await encode(batch)
+                batch = []
+            yield json.dumps({"next_cursor": _encode_cursor(last)}) + "\n"
+            break
+        batch.append(booking)
+        streamed += 1
+        last = booking
+        if len(batch) == STREAM_BATCH_SIZE:
+            yield await encode(batch)
+            batch = []
+    if batch:
+        yield await encode(batch)
 
 
 @router.get("/all", response_model=List[BookingWithDetails])
 async def get_all_bookings(
+    response: Response,
     status: Optional[BookingStatus] = Query(None),
-    current_user = Depends(get_current_admin)
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = Query(None),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    fields: Optional[str] = Query(None, description="Comma-separated response fields"),
+    current_user = Depends(get_current_admin),
+    loaders: Loaders = Depends(get_loaders)
 ):
-    """Get all bookings (Admin only)."""
+    """
+    Get all bookings (Admin only).
+    
+    Bookings come newest first. With `limit`, a page is returned and the
+    `X-Next-Cursor` header carries the `cursor` for the next one;
+    `format=ndjson` streams one booking per line instead, ending a page
+    that has a successor with a `{"next_cursor": ...}` line.
+    """
     db = get_database()
+    selected = parse_fields(fields, BookingWithDetails)
     
     query = {}
     if status:
         query["status"] = status
+    if cursor:
+        query.update(_decode_cursor(cursor))
     
-    cursor = db.bookings.find(query).sort("created_at", -1)
-    bookings = await cursor.to_list(length=None)
+    bookings_cursor = db.bookings.find(
+        query,
+        # created_at is always read so the next cursor can be built
+        {**projection(selected, BOOKING_FIELD_SOURCES), "created_at": 1} if selected else None
+    ).sort([("created_at", -1), ("_id", -1)])
     
-    result = []
-    for booking in bookings:
-        lot, slot, vehicle, user_doc = await gather(
-            db.parking_lots.find_one({"_id": ObjectId(booking["lot_id"])}),
-            db.parking_slots.find_one({"_id": ObjectId(booking["slot_id"])}),
-            db.vehicles.find_one({"_id": ObjectId(booking["vehicle_id"])}),
-            db.users.find_one({"_id": ObjectId(booking["user_id"])}),
-        )
-
-        lot_response = None
-        if lot:
-            lot_response = ParkingLotResponse(
-                id=str(lot["_id"]),
-                name=lot["name"],
-                address=lot["address"],
-                latitude=lot["latitude"],
-                longitude=lot["longitude"],
-                total_slots=lot["total_slots"],
-                available_slots=lot["available_slots"]
-,
-                price_per_hour=lot["price_per_hour"],
-                operating_hours=lot["operating_hours"],
-                amenities=lot.get("amenities", []),
-                image_url=lot.get("image_url"),
-                is_active=lot["is_active"],
-                rating=lot.get("rating"),
-                total_reviews=lot.get("total_reviews", 0),
-                created_at=lot["created_at"]
-            )
+    if format == "ndjson":
+        if limit:
+            # One extra row tells whether another page exists
+            bookings_cursor = bookings_cursor.limit(limit + 1)
+        return StreamingResponse(
+            _stream_with_details(db, bookings_cursor.batch_size(STREAM_BATCH_SIZE), selected, limit),
+            media_type="application/x-ndjson"
+        )
+    
+    next_cursor = None
+    if limit is None:
+        bookings = await bookings_cursor.to_list(length=None)
+    else:
+        # Fetch one extra row to learn whether another page exists
+        bookings = await bookings_cursor.limit(limit + 1).to_list(length=None)
+        if len(bookings) > limit:
+            bookings = bookings[:limit]
+            next_cursor = _encode_cursor(bookings[-1])
+    
+    if selected:
+        rows = await _detail_rows(loaders, bookings, selected)
+        sparse = sparse_response(BookingWithDetails, selected, rows)
+        if next_cursor:
+            sparse.headers["X-Next-Cursor"] = next_cursor
+        return sparse
+    
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return await _with_details(loaders, bookings)
 
-        vehicle_response = None
-        if vehicle:
-            vehicle_response = VehicleResponse(
-                id=str(vehicle["_id"]),
-                user_id=vehicle["user_id"],
-                license_plate=vehicle["license_plate"],
-                make=vehicle["make"],
-                model=vehicle["model"],
-                color=vehicle.get("color"),
-                vehicle_type=vehicle["vehicle_type"],
-                created_at=vehicle["created_at"]
-            )
 
-        receipt_payload = await _maybe_build_receipt(
-            booking=booking,
-            lot=lot,
-            slot=slot,
-            vehicle=vehicle,
-            user=user_doc,
+@router.get("/{booking_id}", response_model=BookingWithDetails)
+async def get_booking(
+    booking_id: str,
+    current_user = Depends(get_current_user),
+    loaders: Loaders = Depends(get_loaders)
+):
+    """Get a specific booking by ID."""
+    db = get_database()
+    
+    try:
+        booking = await db.bookings.find_one({"_id": ObjectId(booking_id)})
+    except:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid booking ID"
+        )
+    
+    if not booking:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Booking not found"
+        )
+    
+    # Check if user owns this booking or is admin
+    if booking["user_id"] != current_user.user_id and current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to view this booking"
         )
+    
+    booking_details, = await _with_details(loaders, [booking])
+    return booking_details
 
-        result.append(BookingWithDetails(
-            id=str(booking["_id"]),
-            user_id=booking["user_id"],
-            lot_id=booking["lot_id"],
-            slot_id=booking["slot_id"],
-            vehicle_id=booking["vehicle_id"],
-            start_time=booking["start_time"],
-            end_time=booking["end_time"],
-            status=booking["status"],
-            total_price=booking["total_price"],
-            payment_status=booking["payment_status"],
-            qr_code=booking.get("qr_code"),
-            created_at=booking["created_at"],
-            updated_at=booking["updated_at"],
-            parking_lot=lot_response,
-            vehicle=vehicle_response,
-            receipt=receipt_payload
-        ))
 
-    return result
+@router.get("/{booking_id}/qr")
+async def get_booking_qr(
+    booking_id: str,
+    format: str = Query("png", pattern="^(png|svg)$"),
+    current_user = Depends(get_current_user)
+):
+    """Render a booking's QR code as a PNG or SVG image."""
+    db = get_database()
+    
+    try:
+        booking = await db.bookings.find_one(
+            {"_id": ObjectId(booking_id)},
+            {"user_id": 1, "qr_payload": 1}
+        )
+    except:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid booking ID"
+        )
+    
+    if not booking:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Booking not found"
+        )
+    
+    # Check if user owns this booking or is admin
+    if booking["user_id"] != current_user.user_id and current_user.role != "admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to view this booking"
+        )
+    
+    try:
+        image = await render_service.qr_image(_qr_payload(booking), format)
+    except Exception as err:
+        logger.error(f"Failed to render QR code for booking {booking_id}: {err}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to render QR code"
+        )
+    
+    # The payload never changes, so browsers can keep the image
+    return Response(
+        content=image,
+        media_type=QR_MEDIA_TYPES[format],
+        headers={"Cache-Control": "private, max-age=86400"}
+    )
 
 
-@router.get("/{booking_id}", response_model=BookingWithDetails)
-async def get_booking(
+@router.get("/{booking_id}/receipt.pdf")
+async def download_receipt_pdf(
     booking_id: str,
+    request: Request,
     current_user = Depends(get_current_user)
 ):
-    """Get a specific booking by ID."""
+    """Download a booking's receipt as a PDF."""
     db = get_database()
     
     try:
@@ -462,85 +1033,59 @@ async def get_booking(
             detail="Not authorized to view this booking"
         )
     
-    # Get parking lot details
-    lot = await db.parking_lots.find_one({"_id": ObjectId(booking["lot_id"])})
-    lot_response = None
-    if lot:
-        lot_response = ParkingLotResponse(
-            id=str(lot["_id"]),
-            name=lot["name"],
-            address=lot["address"],
-            latitude=lot["latitude"],
-            longitude=lot["longitude"],
-            total_slots=lot["total_slots"],
-            available_slots=lot["available_slots"],
-            price_per_hour=lot["price_per_hour"],
-            operating_hours=lot["operating_hours"],
-            amenities=lot.get("amenities", []),
-            image_url=lot.get("image_url"),
-            is_active=lot["is_active"],
-            rating=lot.get("rating"),
-            total_reviews=lot.get("total_reviews", 0),
-            created_at=lot["created_at"]
-        )
-    
-    # Get vehicle details
-    vehicle = await db.vehicles.find_one({"_id": ObjectId(booking["vehicle_id"])})
-    vehicle_response = None
-    if vehicle:
-        vehicle_response = VehicleResponse(
-            id=str(vehicle["_id"]),
-            user_id=vehicle["user_id"],
-            license_plate=vehicle["license_plate"],
-            make=vehicle["make"],
-            model=vehicle["model"],
-            color=vehicle.get("color"),
-            vehicle_type=vehicle["vehicle_type"],
-            created_at=vehicle["created_at"]
+    # Any change to the booking bumps updated_at and with it the ETag
+    cache_key = receipt_cache_key(booking_id, booking["updated_at"])
+    headers = {
+        "ETag": f'"{cache_key}"',
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f'attachment; filename="receipt_{booking_id}.pdf"'
+    }
+    if _etag_matches(request, headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    cached_path = await to_thread(receipt_cache.get_path, cache_key)
+    if cached_path:
+        return FileResponse(cached_path, media_type="application/pdf", headers=headers)
+    
+    lot, slot, vehicle, user = await gather(
+        db.parking_lots.find_one({"_id": ObjectId(booking["lot_id"])}),
+        db.parking_slots.find_one({"_id": ObjectId(booking["slot_id"])}),
+        db.vehicles.find_one({"_id": ObjectId(booking["vehicle_id"])}),
+        db.users.find_one({"_id": ObjectId(booking["user_id"])}),
+    )
+    receipt_payload = await _maybe_build_receipt(
+        booking=booking,
+        lot=lot,
+        slot=slot,
+        vehicle=vehicle,
+        user=user,
+    )
+    if not receipt_payload:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Receipt not available for this booking"
         )
+    if isinstance(receipt_payload, dict):
+        receipt_payload = BookingReceipt(**receipt_payload)
     
-    receipt_payload: Optional[BookingReceipt] = None
-    if lot and vehicle:
-        try:
-            slot = await db.parking_slots.find_one({"_id": ObjectId(booking["slot_id"])}) or {}
-            user = await db.users.find_one({"_id": ObjectId(booking["user_id"])}) or {}
-            receipt_payload = build_receipt_payload(
-                booking_id=str(booking["_id"]),
-                user=user,
-                lot=lot,
-                slot=slot,
-                vehicle=vehicle,
-                start_time=booking["start_time"],
-                end_time=booking["end_time"],
-                booking_status=booking.get("status", BookingStatus.PENDING),
-                payment_status=booking.get("payment_status", PaymentStatus.PENDING),
-                total_price=booking["total_price"],
-                created_at=booking.get("created_at", datetime.utcnow()),
-                qr_code=booking.get("qr_code")
-            )
-        except Exception as err:
-            logger.error(f"Failed to build booking receipt payload: {err}")
-            receipt_payload = booking.get("receipt")
-    else:
-        receipt_payload = booking.get("receipt")
-    
-    return BookingWithDetails(
-        id=str(booking["_id"]),
-        user_id=booking["user_id"],
-        lot_id=booking["lot_id"],
-        slot_id=booking["slot_id"],
-        vehicle_id=booking["vehicle_id"],
-        start_time=booking["start_time"],
-        end_time=booking["end_time"],
-        status=booking["status"],
-        total_price=booking["total_price"],
-        payment_status=booking["payment_status"],
-        qr_code=booking.get("qr_code"),
-        created_at=booking["created_at"],
-        updated_at=booking["updated_at"],
-        parking_lot=lot_response,
-        vehicle=vehicle_response,
-        receipt=receipt_payload
+    try:
+        pdf_receipt = await render_service.receipt_pdf(receipt_payload)
+    except Exception as err:
+        logger.error(f"Failed to generate receipt PDF for booking {booking_id}: {err}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to generate receipt PDF"
+        )
+    
+    try:
+        await to_thread(receipt_cache.put, booking_id, cache_key, pdf_receipt.data)
+    except Exception as err:
+        logger.error(f"Failed to cache receipt PDF for booking {booking_id}: {err}")
+    
+    return Response(
+        content=pdf_receipt.data,
+        media_type=pdf_receipt.content_type,
+        headers=headers
     )
 
 
@@ -575,35 +1120,116 @@ async def update_booking(
         )
     
     update_dict = {k: v for k, v in update_data.dict(exclude_unset=True).items()}
+    was_live = booking["status"] in LIVE_BOOKING_STATUSES
+    # The slot may have been sold again since, so final states are final
+    if not was_live and update_dict.get("status", booking["status"]) in LIVE_BOOKING_STATUSES:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Cancelled or completed bookings can't be reopened"
+        )
+    # Cancelling or completing a live booking gives its slot back
+    leaving_live = was_live and update_dict.get("status", booking["status"]) not in LIVE_BOOKING_STATUSES
+    extended = False
     
     # If extending time, recalculate price
     if "end_time" in update_dict:
+        new_end = to_naive_utc(update_dict["end_time"])
+        if new_end <= booking["start_time"]:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="end_time must be after start_time"
+            )
+        
+        # Only the added tail needs to be free; the booking's own interval
+        # ends where the extension starts, so it never conflicts with itself
+        if new_end > booking["end_time"]:
+            await booking_index.ensure_slot_loaded(db, booking["lot_id"], booking["slot_id"])
+            if not await _slot_is_free(db, booking["lot_id"], booking["slot_id"], booking["end_time"], new_end):
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Parking slot is already booked for the extended time"
+                )
+        
+        # Price before touching the slot so a failure here leaves it as it was
         lot = await db.parking_lots.find_one({"_id": ObjectId(booking["lot_id"])})
-        new_price = calculate_parking_price(
-            lot["price_per_hour"],
-            booking["start_time"],
-            update_dict["end_time"]
-        )
+        tariff = compiled_tariff(lot)
+        if new_end > booking["end_time"]:
+            # The time already booked keeps the price it was quoted at; only
+            # the added time is charged at the current surge. Both ends are
+            # priced from the start so the one-hour minimum is counted once.
+            added = (
+                calculate_parking_price(lot["price_per_hour"], booking["start_time"], new_end, 1.0, tariff)
+                - calculate_parking_price(lot["price_per_hour"], booking["start_time"], booking["end_time"], 1.0, tariff)
+            )
+            new_price = round(
+                booking["total_price"] + added * surge_pricing.multiplier(booking["lot_id"]), 2
+            )
+        else:
+            new_price = calculate_parking_price(
+                lot["price_per_hour"],
+                booking["start_time"],
+                new_end,
+                booking.get("surge_multiplier", 1.0),
+                tariff
+            )
+        update_dict["end_time"] = new_end
         update_dict["total_price"] = new_price
+        
+        if was_live and not leaving_live:
+            extended = await extend_reservation(
+                db,
+                booking["slot_id"],
+                booking_id,
+                booking["start_time"],
+                booking["end_time"],
+                new_end
+            )
+            if not extended:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Parking slot is already booked for the extended time"
+                )
     
-    # If cancelling, free up the slot
-    if update_dict.get("status") == BookingStatus.CANCELLED:
-        await db.parking_slots.update_one(
-            {"_id": ObjectId(booking["slot_id"])},
-            {"$set": {"status": SlotStatus.AVAILABLE, "updated_at": datetime.utcnow()}}
-        )
-        await db.parking_lots.update_one(
-            {"_id": ObjectId(booking["lot_id"])},
-            {"$inc": {"available_slots": 1}, "$set": {"updated_at": datetime.utcnow()}}
-        )
+    # If the booking stops being live, free up the slot once nothing else holds it
+    if leaving_live:
+        if await release_slot(db, booking["slot_id"], booking_id):
+            await db.parking_lots.update_one(
+                {"_id": ObjectId(booking["lot_id"])},
+                {"$inc": {"available_slots": 1}, "$set": {"updated_at": datetime.utcnow()}}
+            )
     
     update_dict["updated_at"] = datetime.utcnow()
     
-    result = await db.bookings.find_one_and_update(
-        {"_id": ObjectId(booking_id)},
-        {"$set": update_dict},
-        return_document=ReturnDocument.AFTER
-    )
+    try:
+        result = await db.bookings.find_one_and_update(
+            {"_id": ObjectId(booking_id)},
+            {"$set": update_dict},
+            return_document=ReturnDocument.AFTER
+        )
+    except Exception:
+        # Put the slot's reservation back to the booking's stored end time
+        if extended:
+            await extend_reservation(
+                db,
+                booking["slot_id"],
+                booking_id,
+                booking["start_time"],
+                new_end,
+                booking["end_time"]
+            )
+        raise
+    
+    if result["status"] not in LIVE_BOOKING_STATUSES:
+        booking_index.remove(booking_id)
+    elif "end_time" in update_dict:
+        booking_index.add(
+            result["lot_id"],
+            result["slot_id"],
+            booking_id,
+            result["start_time"],
+            result["end_time"]
+        )
+        lifecycle_scheduler.track(result)
     
     logger.info(f"Booking updated: {booking_id}")
     
@@ -618,7 +1244,7 @@ async def update_booking(
         status=result["status"],
         total_price=result["total_price"],
         payment_status=result["payment_status"],
-        qr_code=result.get("qr_code"),
+        qr_code=_qr_payload(result),
         created_at=result["created_at"],
         updated_at=result["updated_at"]
     )
\ No newline at end of file
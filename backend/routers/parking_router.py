@@ -2,8 +2,10 @@
 Parking lot and slot management routes.
 """
 from fastapi import APIRouter, HTTPException, status, Depends, Query
-from typing import List, Optional
+from typing import FrozenSet, List, Optional, Tuple
 from bson import ObjectId
+from bson.errors import InvalidId
+import numpy as np
 from datetime import datetime
 from database import get_database
 from models import (
@@ -12,15 +14,39 @@ from models import (
     ParkingLotUpdate,
     ParkingSlotResponse,
     ParkingSearchQuery,
+    ParkingLotAvailability,
+    PriceMatrixRequest,
+    PriceMatrixResponse,
+    PriceQuote,
     SlotStatus
 )
 from auth import get_current_user, get_current_admin
-from utils import calculate_distance
+from booking_index import booking_index
+from config import settings
+from fieldsets import parse_fields, projection, sparse_response
+from pricing import price_matrix, surge_pricing
+from spatial_index import lot_index
+from tariffs import compiled_tariff
+from utils import calculate_parking_price, lot_response, to_naive_utc
 import logging
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/parking", tags=["Parking"])
 
+DEFAULT_NEARBY_LIMIT = 100
+
+# Response fields that are not stored on the lot document under the same name
+LOT_FIELD_SOURCES = {"id": [], "distance": []}
+
+
+def _sparse_lot_row(lot: dict, selected: FrozenSet[str], distance: Optional[float] = None) -> dict:
+    """Pick the selected response fields out of a projected lot document."""
+    row = {name: lot[name] for name in selected if name in lot and name != "distance"}
+    row["id"] = str(lot["_id"])
+    if "distance" in selected:
+        row["distance"] = distance
+    return row
+
 
 @router.post("/lots", response_model=ParkingLotResponse, status_code=status.HTTP_201_CREATED)
 async def create_parking_lot(
@@ -63,6 +89,8 @@ async def create_parking_lot(
         if slots_docs:
             await db.parking_slots.insert_many(slots_docs)
     
+    lot_index.upsert(lot_id, lot_data.latitude, lot_data.longitude)
+    
     logger.info(f"Parking lot created: {lot_data.name}")
     
     return ParkingLotResponse(
@@ -79,52 +107,192 @@ async def get_parking_lots(
     latitude: Optional[float] = Query(None),
     longitude: Optional[float] = Query(None),
     max_distance: float = Query(10.0, description="Maximum distance in km"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="Maximum number of lots to return"),
     is_active: bool = Query(True),
+    fields: Optional[str] = Query(None, description="Comma-separated response fields"),
     current_user = Depends(get_current_user)
 ):
-    """Get all parking lots with optional location-based filtering."""
+    """
+    Get parking lots with optional location-based filtering.
+
+    When coordinates are provided only lots within `max_distance` are
+    read, nearest first, each carrying its `distance` in km (see
+    `_find_nearby_lots`). Location searches return at most
+    DEFAULT_NEARBY_LIMIT lots unless `limit` says otherwise. `fields`
+    trims both the documents read and the lots returned.
+    """
     db = get_database()
+    selected = parse_fields(fields, ParkingLotResponse)
+    lot_projection = projection(selected, LOT_FIELD_SOURCES) if selected else None
     
     query = {"is_active": is_active}
     
-    # Get all parking lots
-    cursor = db.parking_lots.find(query)
-    lots = await cursor.to_list(length=None)
+    if latitude is None or longitude is None:
+        cursor = db.parking_lots.find(query, lot_projection)
+        if limit:
+            cursor = cursor.limit(limit)
+        lots = await cursor.to_list(length=limit)
+        if selected:
+            rows = [_sparse_lot_row(lot, selected) for lot in lots]
+            return sparse_response(ParkingLotResponse, selected, rows)
+        return [lot_response(lot) for lot in lots]
+    
+    nearby = await _find_nearby_lots(
+        db, latitude, longitude, max_distance,
+        limit or DEFAULT_NEARBY_LIMIT, query, lot_projection
+    )
+    if selected:
+        rows = [_sparse_lot_row(lot, selected, distance) for lot, distance in nearby]
+        return sparse_response(ParkingLotResponse, selected, rows)
+    return [lot_response(lot, distance=distance) for lot, distance in nearby]
+
+
+@router.post("/search", response_model=List[ParkingLotAvailability])
+async def search_available_lots(
+    search: ParkingSearchQuery,
+    limit: int = Query(DEFAULT_NEARBY_LIMIT, ge=1, le=1000),
+    current_user = Depends(get_current_user)
+):
+    """
+    Find lots with a free slot for the whole requested time window.
+
+    Slot conflicts are answered by the in-memory booking interval index,
+    so the bookings collection is only read when a lot is first indexed.
+    """
+    if not search.start_time or not search.end_time:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start_time and end_time are required"
+        )
+    start_time = to_naive_utc(search.start_time)
+    end_time = to_naive_utc(search.end_time)
+    if end_time <= start_time:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="end_time must be after start_time"
+        )
+    
+    db = get_database()
+    
+    query = {"is_active": True}
+    price_filter = {}
+    if search.min_price is not None:
+        price_filter["$gte"] = search.min_price
+    if search.max_price is not None:
+        price_filter["$lte"] = search.max_price
+    if price_filter:
+        query["price_per_hour"] = price_filter
+    
+    if search.latitude is not None and search.longitude is not None:
+        # Fetch every lot in range; lots without a free slot are dropped below
+        candidates = await _find_nearby_lots(
+            db, search.latitude, search.longitude, search.max_distance, None, query
+        )
+    else:
+        lots = await db.parking_lots.find(query).to_list(length=None)
+        candidates = [(lot, None) for lot in lots]
+    
+    if not candidates:
+        return []
+    
+    lot_ids = [str(lot["_id"]) for lot, _ in candidates]
+    slot_query = {
+        "lot_id": {"$in": lot_ids},
+        "status": {"$ne": SlotStatus.MAINTENANCE}
+    }
+    if search.slot_type:
+        slot_query["slot_type"] = search.slot_type
+    
+    slots = await db.parking_slots.find(slot_query, {"lot_id": 1}).to_list(length=None)
+    slots_by_lot = {}
+    for slot in slots:
+        slots_by_lot.setdefault(slot["lot_id"], []).append(str(slot["_id"]))
+    
+    await booking_index.ensure_lots_loaded(db, slots_by_lot.keys())
     
     result = []
-    for lot in lots:
-        lot_response = ParkingLotResponse(
-            id=str(lot["_id"]),
-            name=lot["name"],
-            address=lot["address"],
-            latitude=lot["latitude"],
-            longitude=lot["longitude"],
-            total_slots=lot["total_slots"],
-            available_slots=lot["available_slots"],
-            price_per_hour=lot["price_per_hour"],
-            operating_hours=lot["operating_hours"],
-            amenities=lot.get("amenities", []),
-            image_url=lot.get("image_url"),
-            is_active=lot["is_active"],
-            rating=lot.get("rating"),
-            total_reviews=lot.get("total_reviews", 0),
-            created_at=lot["created_at"]
+    for lot, distance in candidates:
+        free = booking_index.free_slots(
+            slots_by_lot.get(str(lot["_id"]), []),
+            start_time,
+            end_time
         )
-        
-        # Filter by distance if coordinates provided
-        if latitude is not None and longitude is not None:
-            distance = calculate_distance(
-                latitude, longitude,
-                lot["latitude"], lot["longitude"]
-            )
-            if distance <= max_distance:
-                result.append(lot_response)
-        else:
-            result.append(lot_response)
+        if not free:
+            continue
+        result.append(ParkingLotAvailability(
+            **lot_response(lot, distance=distance).dict(),
+            free_slots=len(free),
+            free_slot_ids=free
+        ))
+        if len(result) >= limit:
+            break
     
     return result
 
 
+async def _find_nearby_lots(
+    db,
+    latitude: float,
+    longitude: float,
+    max_distance: float,
+    limit: Optional[int],
+    query: dict,
+    lot_projection: Optional[dict] = None
+) -> List[Tuple[dict, float]]:
+    """
+    Return (lot document, distance km) pairs matching `query`, nearest first.
+
+    Active-lot searches are answered by the in-memory lot index and
+    hydrated by `_id`; anything else falls back to $geoNear.
+    """
+    if query.get("is_active") is True and settings.lot_index_enabled:
+        await lot_index.ensure_loaded(db)
+        # The index only knows coordinates, so trim early only when
+        # nothing else in `query` can filter lots out after hydration.
+        extra_filters = set(query) != {"is_active"}
+        matches = lot_index.within_radius(
+            latitude, longitude, max_distance,
+            None if extra_filters else limit
+        )
+        if not matches:
+            return []
+        
+        cursor = db.parking_lots.find(
+            {
+                **query,
+                "_id": {"$in": [ObjectId(lot_id) for lot_id, _ in matches]}
+            },
+            lot_projection
+        )
+        lots = {str(lot["_id"]): lot for lot in await cursor.to_list(length=None)}
+        nearby = [
+            (lots[lot_id], distance)
+            for lot_id, distance in matches
+            if lot_id in lots
+        ]
+        return nearby[:limit] if limit else nearby
+    
+    pipeline = [
+        {
+            "$geoNear": {
+                "near": {"type": "Point", "coordinates": [longitude, latitude]},
+                "key": "location",
+                "distanceField": "distance",
+                "maxDistance": max_distance * 1000,  # metres on a 2dsphere index
+                "spherical": True,
+                "query": query
+            }
+        }
+    ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    if lot_projection:
+        pipeline.append({"$project": {**lot_projection, "distance": 1}})
+    lots = await db.parking_lots.aggregate(pipeline).to_list(length=limit)
+    
+    return [(lot, round(lot["distance"] / 1000, 2)) for lot in lots]
+
+
 @router.get("/lots/{lot_id}", response_model=ParkingLotResponse)
 async def get_parking_lot(
     lot_id: str,
@@ -147,22 +315,99 @@ async def get_parking_lot(
             detail="Parking lot not found"
         )
     
-    return ParkingLotResponse(
-        id=str(lot["_id"]),
-        name=lot["name"],
-        address=lot["address"],
-        latitude=lot["latitude"],
-        longitude=lot["longitude"],
-        total_slots=lot["total_slots"],
-        available_slots=lot["available_slots"],
+    return lot_response(lot)
+
+
+@router.get("/lots/{lot_id}/quote", response_model=PriceQuote)
+async def get_price_quote(
+    lot_id: str,
+    start_time: datetime = Query(...),
+    end_time: datetime = Query(...),
+    current_user = Depends(get_current_user)
+):
+    """Quote the price of parking at a lot for a window, at its current surge."""
+    db = get_database()
+    start_time, end_time = to_naive_utc(start_time), to_naive_utc(end_time)
+    
+    if end_time <= start_time:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="end_time must be after start_time"
+        )
+    
+    try:
+        lot = await db.parking_lots.find_one({"_id": ObjectId(lot_id)}, {"price_per_hour": 1, "tariffs": 1})
+    except:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid lot ID"
+        )
+    
+    if not lot:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Parking lot not found"
+        )
+    
+    surge = surge_pricing.surge(lot_id)
+    return PriceQuote(
+        lot_id=lot_id,
+        start_time=start_time,
+        end_time=end_time,
         price_per_hour=lot["price_per_hour"],
-        operating_hours=lot["operating_hours"],
-        amenities=lot.get("amenities", []),
-        image_url=lot.get("image_url"),
-        is_active=lot["is_active"],
-        rating=lot.get("rating"),
-        total_reviews=lot.get("total_reviews", 0),
-        created_at=lot["created_at"]
+        surge_multiplier=surge.multiplier,
+        occupancy=surge.occupancy,
+        total_price=calculate_parking_price(
+            lot["price_per_hour"],
+            start_time,
+            end_time,
+            surge.multiplier,
+            compiled_tariff(lot)
+        ),
+        surge_computed_at=surge_pricing.computed_at
+    )
+
+
+@router.post("/quotes", response_model=PriceMatrixResponse)
+async def get_price_matrix(
+    quote_request: PriceMatrixRequest,
+    current_user = Depends(get_current_user)
+):
+    """Quote many lots over many time windows in one call."""
+    db = get_database()
+    
+    lot_ids = list(dict.fromkeys(quote_request.lot_ids))
+    try:
+        for lot_id in lot_ids:
+            ObjectId(lot_id)
+    except InvalidId:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid lot ID"
+        )
+    
+    rates = await surge_pricing.lot_rates(db, lot_ids)
+    
+    known = [lot_id for lot_id in lot_ids if lot_id in rates]
+    matrix = price_matrix(
+        [rates[lot_id] for lot_id in known],
+        np.array([surge_pricing.multiplier(lot_id) for lot_id in known], dtype=float),
+        [
+            (to_naive_utc(window.start_time), to_naive_utc(window.end_time))
+            for window in quote_request.windows
+        ]
+    )
+    
+    rows = dict(zip(known, matrix.tolist()))
+    return PriceMatrixResponse(
+        lot_ids=lot_ids,
+        windows=quote_request.windows,
+        surge_multipliers=[
+            surge_pricing.multiplier(lot_id) if lot_id in rows else None
+            for lot_id in lot_ids
+        ],
+        prices=[rows.get(lot_id, [None] * len(quote_request.windows)) for lot_id in lot_ids],
+        surge_computed_at=surge_pricing.computed_at
     )
 
 
@@ -214,25 +459,15 @@ async def update_parking_lot(
             detail="Parking lot not found"
         )
     
+    if result["is_active"]:
+        lot_index.upsert(lot_id, result["latitude"], result["longitude"])
+    else:
+        lot_index.remove(lot_id)
+    surge_pricing.set_rates(lot_id, result)
+    
     logger.info(f"Parking lot updated: {lot_id}")
     
-    return ParkingLotResponse(
-        id=str(result["_id"]),
-        name=result["name"],
-        address=result["address"],
-        latitude=result["latitude"],
-        longitude=result["longitude"],
-        total_slots=result["total_slots"],
-        available_slots=result["available_slots"],
-        price_per_hour=result["price_per_hour"],
-        operating_hours=result["operating_hours"],
-        amenities=result.get("amenities", []),
-        image_url=result.get("image_url"),
-        is_active=result["is_active"],
-        rating=result.get("rating"),
-        total_reviews=result.get("total_reviews", 0),
-        created_at=result["created_at"]
-    )
+    return lot_response(result)
 
 
 @router.delete("/lots/{lot_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -257,6 +492,9 @@ async def delete_parking_lot(
             detail="Parking lot not found"
         )
     
+    lot_index.remove(lot_id)
+    surge_pricing.set_rates(lot_id, None)
+    
     # Delete associated slots
     await db.parking_slots.delete_many({"lot_id": lot_id})
     
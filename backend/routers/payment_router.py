@@ -1,12 +1,14 @@
 """
 Payment router for handling dummy payments.
 """
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Header, status
 from pydantic import BaseModel
+from typing import Optional
 import logging
 import uuid
 import asyncio
 from auth import get_current_user
+from idempotency import IDEMPOTENCY_HEADER, run_idempotent
 
 router = APIRouter(prefix="/api/payments", tags=["Payments"])
 logger = logging.getLogger(__name__)
@@ -24,12 +26,24 @@ class DummyPaymentResponse(BaseModel):
 @router.post("/process-dummy-payment", response_model=DummyPaymentResponse)
 async def process_dummy_payment(
     request: DummyPaymentRequest,
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None, alias=IDEMPOTENCY_HEADER)
 ):
     """
     Process a dummy payment.
-    Simulates a payment delay and returns success.
+    Simulates a payment delay and returns success. Retries carrying the
+    same Idempotency-Key get the original transaction back.
     """
+    return await run_idempotent(
+        idempotency_key,
+        f"{current_user.user_id}:process_dummy_payment",
+        request,
+        status.HTTP_200_OK,
+        lambda: _process_dummy_payment(request)
+    )
+
+
+async def _process_dummy_payment(request: DummyPaymentRequest) -> DummyPaymentResponse:
     try:
         # Simulate processing delay
         await asyncio.sleep(1.5)
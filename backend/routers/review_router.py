@@ -1,6 +1,8 @@
 """
 Review and rating routes for parking lots.
 """
+from asyncio import gather
+
 from fastapi import APIRouter, HTTPException, status, Depends
 from typing import List
 from bson import ObjectId
@@ -8,6 +10,7 @@ from datetime import datetime
 from database import get_database
 from models import ReviewCreate, ReviewResponse
 from auth import get_current_user
+from loaders import Loaders, get_loaders
 import logging
 
 logger = logging.getLogger(__name__)
@@ -17,14 +20,18 @@ router = APIRouter(prefix="/api/reviews", tags=["Reviews"])
 @router.post("", response_model=ReviewResponse, status_code=status.HTTP_201_CREATED)
 async def create_review(
     review_data: ReviewCreate,
-    current_user = Depends(get_current_user)
+    current_user = Depends(get_current_user),
+    loaders: Loaders = Depends(get_loaders)
 ):
     """Create a review for a parking lot."""
     db = get_database()
     
-    # Verify parking lot exists
+    # Verify parking lot exists, fetching the reviewer in the same round
     try:
-        lot = await db.parking_lots.find_one({"_id": ObjectId(review_data.lot_id)})
+        lot, user = await gather(
+            loaders.lots.load(review_data.lot_id),
+            loaders.users.load(current_user.user_id)
+        )
     except:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -62,9 +69,6 @@ async def create_review(
             detail="You have already reviewed this parking lot"
         )
     
-    # Get user info
-    user = await db.users.find_one({"_id": ObjectId(current_user.user_id)})
-    
     # Create review document
     review_doc = {
         **review_data.dict(),
@@ -0,0 +1,168 @@
+"""
+In-memory spatial index of active parking lot locations.
+
+Lots are bucketed into a fixed lat/lon grid so radius and k-nearest
+searches only look at the cells around the query point. The index holds
+coordinates only; callers hydrate the returned lot ids from MongoDB so
+live counters such as `available_slots` are never served stale.
+"""
+import asyncio
+import logging
+import time
+from math import cos, floor, radians
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from config import settings
+from utils import rank_by_distance
+
+logger = logging.getLogger(__name__)
+
+KM_PER_DEGREE_LAT = 111.32
+
+
+class LotSpatialIndex:
+    """Grid index answering radius and k-nearest queries over lot coordinates."""
+
+    def __init__(self, cell_size_deg: float = 0.05):
+        self.cell_size_deg = cell_size_deg
+        self._lon_cells = int(round(360 / cell_size_deg))
+        self._cells: Dict[Tuple[int, int], Set[str]] = {}
+        self._points: Dict[str, Tuple[float, float]] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    @property
+    def is_loaded(self) -> bool:
+        if self._loaded_at is None:
+            return False
+        max_age = settings.lot_index_refresh_seconds
+        return not max_age or time.monotonic() - self._loaded_at < max_age
+
+    async def ensure_loaded(self, db) -> None:
+        """Load every active lot once, or again after the refresh interval."""
+        if self.is_loaded:
+            return
+        async with self._lock:
+            if self.is_loaded:
+                return
+            cursor = db.parking_lots.find(
+                {"is_active": True},
+                {"latitude": 1, "longitude": 1}
+            )
+            lots = await cursor.to_list(length=None)
+
+            self._cells = {}
+            self._points = {}
+            for lot in lots:
+                self.upsert(str(lot["_id"]), lot["latitude"], lot["longitude"])
+            self._loaded_at = time.monotonic()
+            logger.info(f"Lot spatial index loaded with {len(lots)} lots")
+
+    def invalidate(self) -> None:
+        """Force a full reload on the next query."""
+        self._loaded_at = None
+
+    def upsert(self, lot_id: str, latitude: float, longitude: float) -> None:
+        """Insert a lot or move it to new coordinates."""
+        self.remove(lot_id)
+        self._points[lot_id] = (latitude, longitude)
+        self._cells.setdefault(self._cell(latitude, longitude), set()).add(lot_id)
+
+    def remove(self, lot_id: str) -> None:
+        """Drop a lot from the index if present."""
+        point = self._points.pop(lot_id, None)
+        if point is None:
+            return
+        cell = self._cell(*point)
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(lot_id)
+            if not members:
+                del self._cells[cell]
+
+    def within_radius(
+        self,
+        latitude: float,
+        longitude: float,
+        radius_km: float,
+        limit: Optional[int] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Return (lot_id, distance_km) pairs within `radius_km`, nearest first.
+        """
+        candidates = list(self._candidates(latitude, longitude, radius_km))
+        if not candidates:
+            return []
+
+        points = np.array([self._points[lot_id] for lot_id in candidates])
+        indices, distances = rank_by_distance(
+            latitude, longitude,
+            points[:, 0], points[:, 1],
+            max_distance=radius_km,
+            limit=limit
+        )
+        return [
+            (candidates[index], float(distance))
+            for index, distance in zip(indices, distances)
+        ]
+
+    def nearest(
+        self,
+        latitude: float,
+        longitude: float,
+        k: int,
+        max_distance_km: Optional[float] = None
+    ) -> List[Tuple[str, float]]:
+        """Return the `k` nearest lots, optionally bounded by `max_distance_km`."""
+        if not self._points or k <= 0:
+            return []
+
+        # Grow the search radius until it holds k lots; every lot inside the
+        # radius is scanned, so the first k of that set are the true nearest.
+        radius = self.cell_size_deg * KM_PER_DEGREE_LAT
+        ceiling = max_distance_km if max_distance_km is not None else 20037.5
+        while True:
+            radius = min(radius, ceiling)
+            matches = self.within_radius(latitude, longitude, radius)
+            if len(matches) >= k or radius >= ceiling:
+                return matches[:k]
+            radius *= 2
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        row = floor((latitude + 90) / self.cell_size_deg)
+        col = floor((longitude + 180) / self.cell_size_deg) % self._lon_cells
+        return row, col
+
+    def _candidates(self, latitude: float, longitude: float, radius_km: float):
+        """Yield lot ids from every grid cell the search circle can touch."""
+        lat_delta = radius_km / KM_PER_DEGREE_LAT
+        min_lat = max(latitude - lat_delta, -90.0)
+        max_lat = min(latitude + lat_delta, 90.0)
+
+        # Longitude degrees shrink towards the poles; scan the full ring of
+        # cells once the circle reaches a pole or wraps the whole globe.
+        widest_lat = max(abs(min_lat), abs(max_lat))
+        lon_scale = cos(radians(widest_lat)) * KM_PER_DEGREE_LAT
+        if widest_lat >= 89.9 or radius_km / lon_scale >= 180:
+            cols = range(self._lon_cells)
+        else:
+            lon_delta = radius_km / lon_scale
+            first = floor((longitude - lon_delta + 180) / self.cell_size_deg)
+            last = floor((longitude + lon_delta + 180) / self.cell_size_deg)
+            cols = {col % self._lon_cells for col in range(first, last + 1)}
+
+        first_row = floor((min_lat + 90) / self.cell_size_deg)
+        last_row = floor((max_lat + 90) / self.cell_size_deg)
+        for row in range(first_row, last_row + 1):
+            for col in cols:
+                members = self._cells.get((row, col))
+                if members:
+                    yield from members
+
+
+lot_index = LotSpatialIndex()
@@ -0,0 +1,123 @@
+"""
+Time-of-day tariffs compiled for constant-time pricing.
+
+A lot's `tariffs` are bands such as peak, off-peak, night or weekend
+rates, each covering a daily time range on some weekdays. Minutes no
+band covers are charged at the lot's flat `price_per_hour`, and later
+bands override earlier ones where they overlap. Band times are local
+wall-clock times at `tariff_utc_offset_minutes` from UTC.
+
+Each tariff is compiled once into a per-minute rate array for one week
+and its prefix sum. The charge for any interval is then the difference
+of two cumulative lookups, however long the interval, with partial
+minutes interpolated.
+"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+from utils import to_naive_utc
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# A Monday, so minute 0 of every week is Monday 00:00
+WEEK_EPOCH = datetime(1970, 1, 5)
+
+COMPILED_CACHE_SIZE = 1024
+
+
+def parse_band_time(value: str) -> int:
+    """Minutes after midnight for an "HH:MM" time; "24:00" is end of day."""
+    hours, minutes = value.split(":")
+    total = int(hours) * 60 + int(minutes)
+    if not 0 <= int(minutes) < 60 or not 0 <= total <= MINUTES_PER_DAY:
+        raise ValueError(f"Invalid time {value!r}, expected HH:MM")
+    return total
+
+
+def week_minutes(moments: List[datetime]) -> np.ndarray:
+    """Local minutes elapsed since WEEK_EPOCH for each moment."""
+    offset = settings.tariff_utc_offset_minutes
+    return np.array([
+        (to_naive_utc(moment) - WEEK_EPOCH).total_seconds() / 60 + offset
+        for moment in moments
+    ])
+
+
+class CompiledTariff:
+    """Prefix sums of a lot's weekly per-minute rates."""
+
+    def __init__(self, price_per_hour: float, bands: List[dict]):
+        rates = np.full(MINUTES_PER_WEEK, price_per_hour / 60)
+        for band in bands:
+            rate = band["price_per_hour"] / 60
+            start = parse_band_time(band["start"])
+            end = parse_band_time(band["end"])
+            for day in band["days"]:
+                day_start = day * MINUTES_PER_DAY
+                if start < end:
+                    rates[day_start + start:day_start + end] = rate
+                else:
+                    # Runs past midnight into the next day (and from Sunday into Monday)
+                    rates[day_start + start:day_start + MINUTES_PER_DAY] = rate
+                    next_day = (day + 1) % 7 * MINUTES_PER_DAY
+                    rates[next_day:next_day + end] = rate
+
+        self._rates = rates
+        self._prefix = np.concatenate(([0.0], np.cumsum(rates)))
+
+    def _cumulative(self, minutes: np.ndarray) -> np.ndarray:
+        """Charge accrued from WEEK_EPOCH up to each minute offset."""
+        weeks, offset = np.divmod(minutes, MINUTES_PER_WEEK)
+        whole = offset.astype(int)
+        partial = offset - whole
+        return weeks * self._prefix[-1] + self._prefix[whole] + partial * self._rates[whole]
+
+    def cost_many(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """Charges for intervals given as week-minute arrays."""
+        return self._cumulative(ends) - self._cumulative(starts)
+
+    def cost(self, start: datetime, end: datetime) -> float:
+        """Charge for parking from `start` to `end`."""
+        start_minute, end_minute = week_minutes([start, end])
+        return float(self.cost_many(np.array([start_minute]), np.array([end_minute]))[0])
+
+
+# lot ID -> (price and bands it was compiled from, compiled tariff)
+_compiled: "OrderedDict[str, Tuple[tuple, CompiledTariff]]" = OrderedDict()
+
+
+def compiled_tariff(lot: dict) -> Optional[CompiledTariff]:
+    """
+    The compiled tariff of a lot document, or None for flat-rate lots.
+
+    Compiled tariffs are cached per lot and rebuilt when its price or
+    bands change.
+    """
+    bands = lot.get("tariffs")
+    if not bands:
+        return None
+
+    lot_id = str(lot["_id"])
+    signature = (
+        lot["price_per_hour"],
+        tuple(
+            (tuple(band["days"]), band["start"], band["end"], band["price_per_hour"])
+            for band in bands
+        )
+    )
+    cached = _compiled.get(lot_id)
+    if cached is not None and cached[0] == signature:
+        _compiled.move_to_end(lot_id)
+        return cached[1]
+
+    tariff = CompiledTariff(lot["price_per_hour"], bands)
+    _compiled[lot_id] = (signature, tariff)
+    _compiled.move_to_end(lot_id)
+    while len(_compiled) > COMPILED_CACHE_SIZE:
+        _compiled.popitem(last=False)
+    return tariff
@@ -2,14 +2,19 @@
 Utility functions for QR code generation, email sending, etc.
 """
 import base64
+import hashlib
+import hmac
 import io
 import logging
 from dataclasses import dataclass
-from datetime import datetime, timedelta
-from typing import Any, Dict, Optional
+from datetime import datetime, timedelta, timezone
+from math import atan2, cos, radians, sin, sqrt
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
 
 import aiosmtplib
+import numpy as np
 import qrcode
+from qrcode.image.svg import SvgPathImage
 from email import encoders
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
@@ -30,13 +35,22 @@ from config import settings
 from models import (
     BookingReceipt,
     BookingStatus,
+    ParkingLotResponse,
     PaymentStatus,
     ReceiptSlotInfo,
     ReceiptVehicleInfo,
 )
 
+if TYPE_CHECKING:
+    from tariffs import CompiledTariff
+
 logger = logging.getLogger(__name__)
 
+EARTH_RADIUS_KM = 6371
+
+QR_PAYLOAD_PREFIX = "PKE1"
+QR_SIGNATURE_BYTES = 12
+
 
 @dataclass
 class ReceiptPDFResult:
@@ -46,6 +60,29 @@ class ReceiptPDFResult:
     data: bytes
 
 
+def lot_response(lot: dict, distance: Optional[float] = None) -> ParkingLotResponse:
+    """Build the ParkingLotResponse for a parking_lots document."""
+    return ParkingLotResponse(
+        id=str(lot["_id"]),
+        name=lot["name"],
+        address=lot["address"],
+        latitude=lot["latitude"],
+        longitude=lot["longitude"],
+        total_slots=lot["total_slots"],
+        available_slots=lot["available_slots"],
+        price_per_hour=lot["price_per_hour"],
+        tariffs=lot.get("tariffs", []),
+        operating_hours=lot["operating_hours"],
+        amenities=lot.get("amenities", []),
+        image_url=lot.get("image_url"),
+        is_active=lot["is_active"],
+        rating=lot.get("rating"),
+        total_reviews=lot.get("total_reviews", 0),
+        created_at=lot["created_at"],
+        distance=distance
+    )
+
+
 def build_receipt_payload(
     *,
     booking_id: str,
@@ -95,6 +132,51 @@ def build_receipt_payload(
     )
 
 
+def sign_qr_payload(booking_id: str) -> str:
+    """
+    Build the compact, signed string a booking's QR code encodes.
+    
+    The payload is the booking ID with a truncated HMAC of it under the
+    app's secret key, so codes can't be made up for other bookings; the
+    image itself is rendered on demand.
+    """
+    digest = hmac.new(
+        settings.secret_key.encode(),
+        booking_id.encode(),
+        hashlib.sha256
+    ).digest()
+    signature = base64.urlsafe_b64encode(digest[:QR_SIGNATURE_BYTES]).decode().rstrip("=")
+    return f"{QR_PAYLOAD_PREFIX}:{booking_id}:{signature}"
+
+
+def render_qr_image(data: str, image_format: str = "png") -> bytes:
+    """
+    Render a QR code as PNG or SVG bytes.
+    
+    Args:
+        data: String data to encode in QR code
+        image_format: "png" or "svg"
+        
+    Returns:
+        Encoded image bytes
+    """
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    
+    buffer = io.BytesIO()
+    if image_format == "svg":
+        qr.make_image(image_factory=SvgPathImage).save(buffer)
+    else:
+        qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
 def generate_qr_code(data: str) -> str:
     """
     Generate a QR code from data and return as base64 string.
@@ -106,22 +188,7 @@ def generate_qr_code(data: str) -> str:
         Base64 encoded QR code image
     """
     try:
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Convert to base64
-        buffer = io.BytesIO()
-        img.save(buffer, format='PNG')
-        img_str = base64.b64encode(buffer.getvalue()).decode()
-        
+        img_str = base64.b64encode(render_qr_image(data)).decode()
         return f"data:image/png;base64,{img_str}"
         
     except Exception as e:
@@ -460,16 +527,15 @@ def build_receipt_table(data_rows: list[list[Any]]) -> Table:
 
 
 def build_receipt_qr_image(qr_code_data: str):
-    """Decode base64 QR code and embed into PDF."""
+    """Render the booking QR payload (or a legacy base64 image) into the PDF."""
     from reportlab.platypus import Image
 
     data_uri_prefix = "data:image/png;base64,"
-    if not qr_code_data.startswith(data_uri_prefix):
-        logger.warning("Unexpected QR code format for PDF inclusion.")
-        return Paragraph("QR code unavailable", getSampleStyleSheet()["BodyText"])
-
     try:
-        qr_bytes = base64.b64decode(qr_code_data[len(data_uri_prefix):])
+        if qr_code_data.startswith(data_uri_prefix):
+            qr_bytes = base64.b64decode(qr_code_data[len(data_uri_prefix):])
+        else:
+            qr_bytes = render_qr_image(qr_code_data)
         return Image(io.BytesIO(qr_bytes), width=120, height=120)
     except Exception as err:
         logger.error(f"Failed to embed QR code in receipt PDF: {err}")
@@ -490,11 +556,24 @@ def calculate_duration_hours(start_time: datetime, end_time: datetime) -> str:
     return ", ".join(parts) if parts else "Less than 1 hour"
 
 
+def to_naive_utc(value: datetime) -> datetime:
+    """
+    Normalize a datetime to naive UTC, the form MongoDB hands back.
+    
+    Request bodies may carry offsets while stored documents come back
+    naive, and the two cannot be compared directly.
+    """
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
 def calculate_parking_price(
     price_per_hour: float,
     start_time: datetime,
     end_time: datetime,
-    surge_multiplier: float = 1.0
+    surge_multiplier: float = 1.0,
+    tariff: Optional["CompiledTariff"] = None
 ) -> float:
     """
     Calculate parking price based on duration and surge pricing.
@@ -504,6 +583,7 @@ def calculate_parking_price(
         start_time: Booking start time
         end_time: Booking end time
         surge_multiplier: Surge pricing multiplier (default 1.0)
+        tariff: Compiled time-of-day tariff of the lot, if it has one
         
     Returns:
         Total price
@@ -514,7 +594,10 @@ def calculate_parking_price(
     if duration_hours < 1:
         duration_hours = 1
     
-    base_price = price_per_hour * duration_hours
+    if tariff is not None:
+        base_price = tariff.cost(start_time, max(end_time, start_time + timedelta(hours=1)))
+    else:
+        base_price = price_per_hour * duration_hours
     total_price = base_price * surge_multiplier
     
     return round(total_price, 2)
@@ -531,10 +614,6 @@ def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     Returns:
         Distance in kilometers
     """
-    from math import radians, sin, cos, sqrt, atan2
-    
-    R = 6371  # Earth's radius in kilometers
-    
     lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
     
     dlat = lat2 - lat1
@@ -543,5 +622,66 @@ def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
     c = 2 * atan2(sqrt(a), sqrt(1-a))
     
-    distance = R * c
-    return round(distance, 2)
\ No newline at end of file
+    distance = EARTH_RADIUS_KM * c
+    return round(distance, 2)
+
+
+def calculate_distances(
+    lat: float,
+    lon: float,
+    lat_array: np.ndarray,
+    lon_array: np.ndarray
+) -> np.ndarray:
+    """
+    Haversine distance from one point to many, in a single vectorized pass.
+    
+    Args:
+        lat, lon: Origin coordinate
+        lat_array, lon_array: Coordinates to measure to (same length)
+        
+    Returns:
+        Unrounded distances in kilometers, aligned with the input arrays
+    """
+    lat1 = np.radians(lat)
+    lat2 = np.radians(np.asarray(lat_array, dtype=np.float64))
+    dlat = lat2 - lat1
+    dlon = np.radians(np.asarray(lon_array, dtype=np.float64)) - np.radians(lon)
+    
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def rank_by_distance(
+    lat: float,
+    lon: float,
+    lat_array: np.ndarray,
+    lon_array: np.ndarray,
+    max_distance: Optional[float] = None,
+    limit: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rank coordinates by distance from an origin.
+    
+    Args:
+        lat, lon: Origin coordinate
+        lat_array, lon_array: Candidate coordinates
+        max_distance: Drop candidates farther than this many km (optional)
+        limit: Keep only the nearest N candidates (optional)
+        
+    Returns:
+        (indices, distances) into the input arrays, nearest first, with
+        distances rounded to 2 decimals like `calculate_distance`
+    """
+    distances = calculate_distances(lat, lon, lat_array, lon_array)
+    indices = np.arange(distances.size)
+    
+    if max_distance is not None:
+        indices = indices[distances <= max_distance]
+    
+    # Partition before sorting so only the kept top N pay for the sort
+    if limit is not None and limit < indices.size:
+        top = np.argpartition(distances[indices], limit - 1)[:limit]
+        indices = indices[top]
+    
+    indices = indices[np.argsort(distances[indices], kind="stable")]
+    return indices, np.round(distances[indices], 2)